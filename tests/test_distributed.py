@@ -0,0 +1,82 @@
+import hist
+import numpy as np
+import pytest
+
+from trigger_sf.util.distributed import SharedAccumulator, balanced_chunks, executor, fill_chunk
+from trigger_sf.util.histograms import merge_histograms
+
+
+class FakeFiller(object):
+    """
+    Stand-in for CreateHistograms, which fills values derived from the file and entry numbers instead of
+    reading ntuples.
+    """
+
+    def __init__(self, storage="weight"):
+        self.storage = storage
+
+    def fill_histogram(self, ntuple_files, entries=None):
+        storage = hist.storage.Weight() if self.storage == "weight" else hist.storage.Double()
+        h = hist.Hist(
+            hist.axis.StrCategory(["a", "b"], name="category"),
+            hist.axis.Regular(10, 0.0, 1.0, name="x"),
+            storage=storage,
+        )
+        for uri in ntuple_files:
+            entry = entries[uri] if entries is not None else np.arange(FILE_ENTRIES[uri])
+            seed = int(uri.split("_")[1])
+            x = (entry * 0.37 + seed * 0.11) % 1.1
+            h.fill("a" if seed % 2 else "b", x, weight=1.0 + (entry % 3))
+        return h
+
+
+FILE_ENTRIES = {"file_0": 1000, "file_1": 0, "file_2": 37, "file_3": 2500, "file_4": 1}
+
+
+@pytest.mark.parametrize("n_chunks", [1, 2, 3, 7, 100, 5000])
+def test_balanced_chunks_cover_all_entries_once(n_chunks):
+    chunks = balanced_chunks(FILE_ENTRIES, n_chunks)
+
+    counts = {uri: np.zeros(n, dtype=int) for uri, n in FILE_ENTRIES.items()}
+    for chunk in chunks:
+        for uri, (start, stop) in chunk.items():
+            assert 0 <= start < stop <= FILE_ENTRIES[uri]
+            counts[uri][start:stop] += 1
+
+    assert all(np.all(c == 1) for c in counts.values())
+    assert len(chunks) <= n_chunks
+
+    # chunk sizes differ by at most one entry
+    sizes = [sum(stop - start for start, stop in chunk.values()) for chunk in chunks]
+    assert max(sizes) - min(sizes) <= 1
+
+
+def test_balanced_chunks_without_entries():
+    assert balanced_chunks({"file_0": 0}, 4) == []
+    assert balanced_chunks({}, 4) == []
+
+
+@pytest.mark.parametrize("storage", ["weight", "double"])
+def test_local_workers_match_serial_fill(storage):
+    filler = FakeFiller(storage)
+    serial = filler.fill_histogram(list(FILE_ENTRIES))
+
+    # same steps as CreateHistograms.fill_events with the process backend
+    chunks = balanced_chunks(FILE_ENTRIES, 4)
+    accumulator = SharedAccumulator(filler.fill_histogram([]))
+    try:
+        with executor("processes", 4) as pool:
+            futures = [
+                pool.submit(fill_chunk, FakeFiller, {"storage": storage}, {}, chunk, accumulator.spec)
+                for chunk in chunks
+            ]
+            returned = [h for h in (future.result() for future in futures) if h is not None]
+        merged = merge_histograms([accumulator.histogram()] + returned)
+    finally:
+        accumulator.close()
+
+    # all workers could add their histograms to the shared buffer
+    assert returned == []
+    np.testing.assert_allclose(merged.values(flow=True), serial.values(flow=True))
+    if storage == "weight":
+        np.testing.assert_allclose(merged.variances(flow=True), serial.variances(flow=True))
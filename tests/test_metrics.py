@@ -0,0 +1,116 @@
+import json
+import multiprocessing
+import os
+import time
+from urllib.request import urlopen
+
+import pytest
+
+from trigger_sf.util.metrics import MetricsRegistry, is_exporting_process, parse_prometheus, serve, write_jsonl
+
+
+@pytest.fixture
+def registry():
+    registry = MetricsRegistry(buckets=(1.0, 10.0))
+    registry.inc("tsf_tasks_started_total", help="number of started tasks", task_family="CreateHistograms")
+    registry.inc("tsf_tasks_started_total", task_family="CreateHistograms")
+    registry.add("tsf_tasks_running", 1, help="number of running tasks", task_family="CreateHistograms")
+    registry.set("tsf_process_bytes_read", 1024, help="bytes read from files by this process")
+    registry.observe("tsf_task_duration_seconds", 0.5, help="run time of tasks", task_family="PlotEfficiencies")
+    registry.observe("tsf_task_duration_seconds", 5.0, task_family="PlotEfficiencies")
+    registry.set("tsf_event_loop_entries", 10, dataset="dy \"m50\"", category="mm_incl")
+    return registry
+
+
+def test_scrape(registry):
+    # local stand-in for a prometheus scrape of the exporter
+    server = serve(registry, port=0)
+    try:
+        port = server.server_address[1]
+        with urlopen(f"http://localhost:{port}/metrics", timeout=10) as response:
+            assert response.status == 200
+            assert response.headers["Content-Type"].startswith("text/plain")
+            text = response.read().decode("utf-8")
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    assert "# TYPE tsf_tasks_started_total counter" in text
+    assert "# HELP tsf_tasks_running number of running tasks" in text
+    assert "# TYPE tsf_task_duration_seconds histogram" in text
+
+    samples = parse_prometheus(text)
+    assert samples['tsf_tasks_started_total{task_family="CreateHistograms"}'] == 2.0
+    assert samples['tsf_tasks_running{task_family="CreateHistograms"}'] == 1.0
+    assert samples["tsf_process_bytes_read"] == 1024.0
+    assert samples['tsf_event_loop_entries{category="mm_incl",dataset="dy \\"m50\\""}'] == 10.0
+
+    # cumulative histogram buckets
+    labels = 'task_family="PlotEfficiencies"'
+    assert samples[f'tsf_task_duration_seconds_bucket{{{labels},le="1.0"}}'] == 1.0
+    assert samples[f'tsf_task_duration_seconds_bucket{{{labels},le="10.0"}}'] == 2.0
+    assert samples[f'tsf_task_duration_seconds_bucket{{{labels},le="+Inf"}}'] == 2.0
+    assert samples[f"tsf_task_duration_seconds_sum{{{labels}}}"] == 5.5
+    assert samples[f"tsf_task_duration_seconds_count{{{labels}}}"] == 2.0
+
+
+def test_scrape_unknown_path(registry):
+    server = serve(registry, port=0)
+    try:
+        with pytest.raises(Exception, match="404"):
+            urlopen(f"http://localhost:{server.server_address[1]}/", timeout=10)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_metric_kind_conflict(registry):
+    with pytest.raises(ValueError):
+        registry.set("tsf_tasks_started_total", 1.0, task_family="CreateHistograms")
+
+
+def _wait_for_lines(path, n, timeout=10.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if os.path.exists(path):
+            with open(path) as f:
+                lines = f.read().splitlines()
+            if len(lines) >= n:
+                return lines
+        time.sleep(0.02)
+    raise TimeoutError(f"{path} did not receive {n} lines")
+
+
+def test_jsonl(registry, tmp_path):
+    path = str(tmp_path / "metrics.jsonl")
+    write_jsonl(registry, path, interval=0.05)
+    lines = _wait_for_lines(path, 2)
+
+    snapshot = json.loads(lines[0])
+    assert set(snapshot) == {"time", "values", "histograms"}
+    values = {(v["name"], tuple(sorted(v["labels"].items()))): v["value"] for v in snapshot["values"]}
+    assert values[("tsf_tasks_started_total", (("task_family", "CreateHistograms"),))] == 2.0
+    assert values[("tsf_process_bytes_read", ())] == 1024.0
+
+    histogram, = snapshot["histograms"]
+    assert histogram["name"] == "tsf_task_duration_seconds"
+    assert histogram["labels"] == {"task_family": "PlotEfficiencies"}
+    assert histogram["buckets"] == [1.0, 10.0]
+    assert histogram["counts"] == [1, 1, 0]
+    assert histogram["sum"] == 5.5
+
+    # snapshots are appended in time order
+    assert json.loads(lines[1])["time"] >= snapshot["time"]
+
+
+def test_jsonl_rotation(registry, tmp_path):
+    path = str(tmp_path / "metrics.jsonl")
+    write_jsonl(registry, path, interval=0.02, max_bytes=1)
+    _wait_for_lines(path + ".1", 1)
+
+
+def test_exporting_process():
+    # spawned workers inherit the owner of the exporters
+    assert is_exporting_process()
+    with multiprocessing.get_context("spawn").Pool(1) as pool:
+        assert pool.apply(is_exporting_process) is False
@@ -2,9 +2,10 @@ from __future__ import annotations
 from functools import cache
 import json
 import order as od
+import os
 from pathlib import Path
 import scinum
-from typing import Any, Dict, Optional
+from typing import Any, Dict, List, Optional
 import yaml
 
 
@@ -20,17 +21,76 @@ def sample_database(database_file: Path | str) -> Dict[str, Any]:
     return sample_database
 
 
-def add_config(analysis: od.Analysis, year: int, postfix: Optional[str] = None):
-    if year != 2018:
-        raise ValueError("other eras than 2018 not implemented yet")
+def sample_xsec(dataset_db_entry: Dict[str, Any]) -> scinum.Number:
+    # cross section of a sample database entry; the optional relative uncertainty 'xsec_unc' is either a
+    # symmetric value or a pair of up and down values
+    unc = dataset_db_entry.get("xsec_unc", None)
+    if unc is None:
+        return scinum.Number(dataset_db_entry["xsec"])
+    if isinstance(unc, (list, tuple)):
+        unc = tuple(complex(0, u) for u in unc)
+    else:
+        unc = complex(0, unc)
+    return scinum.Number(dataset_db_entry["xsec"], {"xsec": unc})
+
+
+# per-era settings of the ultra-legacy Run 2 campaigns; the single muon triggers are given as pairs of the
+# trigger flag in the ntuples and the offline threshold on the leading muon, the dataset names have to match
+# the entries of the sample database
+ERAS = {
+    "2016preVFP": {
+        "id": 2,
+        "year": 2016,
+        "lumi": 19.52,
+        "data_sub_eras": ["B-ver2_HIPM", "C-HIPM", "D-HIPM", "E-HIPM", "F-HIPM"],
+        "data_dataset": "SingleMuon_Run2016{sub_era}-UL2016",
+        "mc_dataset_postfix": "RunIISummer20UL16NanoAODAPVv9-106X",
+        "single_mu_triggers": [("trg_single_mu24", 25.)],
+    },
+    "2016postVFP": {
+        "id": 3,
+        "year": 2016,
+        "lumi": 16.81,
+        "data_sub_eras": ["F", "G", "H"],
+        "data_dataset": "SingleMuon_Run2016{sub_era}-UL2016",
+        "mc_dataset_postfix": "RunIISummer20UL16NanoAODv9-106X",
+        "single_mu_triggers": [("trg_single_mu24", 25.)],
+    },
+    "2017": {
+        "id": 4,
+        "year": 2017,
+        "lumi": 41.48,
+        "data_sub_eras": ["B", "C", "D", "E", "F"],
+        "data_dataset": "SingleMuon_Run2017{sub_era}-UL2017",
+        "mc_dataset_postfix": "RunIISummer20UL17NanoAODv9-106X",
+        "single_mu_triggers": [("trg_single_mu27", 28.)],
+    },
+    "2018": {
+        "id": 1,
+        "year": 2018,
+        "lumi": 59.83,
+        "data_sub_eras": ["A", "B", "C", "D"],
+        "data_dataset": "SingleMuon_Run2018{sub_era}-UL2018",
+        "mc_dataset_postfix": "RunIISummer20UL18NanoAODv9-106X",
+        "single_mu_triggers": [("trg_single_mu27", 28.), ("trg_single_mu24", 25.)],
+    },
+}
+
+
+def add_config(analysis: od.Analysis, era: str, postfix: Optional[str] = None):
+    if era not in ERAS:
+        raise ValueError(f"unknown era {era}, known eras are {list(ERAS)}")
+    era_settings = ERAS[era]
 
     # create the campaign
     cpn = od.Campaign(
-        name="ul_2018",
-        id=1,
+        name=f"ul_{era}",
+        id=era_settings["id"],
         aux={
-            "year": 2018,
-            "lumi": 59.83,
+            "era": era,
+            "year": era_settings["year"],
+            "lumi": era_settings["lumi"],
+            "single_mu_triggers": era_settings["single_mu_triggers"],
         },
     )
 
@@ -65,6 +125,7 @@ def add_processes(analysis: od.Analysis, config: od.Config):
 
 
 def add_datasets(analysis: od.Analysis, config: od.Config):
+    era_settings = ERAS[config.campaign.x.era]
 
     # get processes
     data = config.get_process("data")
@@ -75,16 +136,16 @@ def add_datasets(analysis: od.Analysis, config: od.Config):
     id = 1
 
     # add data samples
-    for sub_era in ["A", "B", "C", "D"]:
+    for sub_era in era_settings["data_sub_eras"]:
         # construct the dataset name
-        name = f"SingleMuon_Run2018{sub_era}-UL2018"
+        name = era_settings["data_dataset"].format(sub_era=sub_era)
 
         # get sample database
         dataset_db_entry = sample_database(analysis.x.sample_database_path)[name]
 
         # create process
         process = data.add_process(
-            name="data_singlemuon_2018{}".format(sub_era),
+            name="data_singlemuon_{}{}".format(config.campaign.x.era, sub_era.split("-")[0]),
             id=data.id + id,
             is_data=True,
         )
@@ -106,7 +167,7 @@ def add_datasets(analysis: od.Analysis, config: od.Config):
     # add DY+Jets samples
     for pt_bin in ["0To50", "50To100", "100To250", "250To400", "400To650", "650ToInf"]:
         # construct the dataset and process name
-        name = f"DYJetsToLL_LHEFilterPtZ-{pt_bin}_MatchEWPDG20_TuneCP5_13TeV-amcatnloFXFX-pythia8_RunIISummer20UL18NanoAODv9-106X"
+        name = f"DYJetsToLL_LHEFilterPtZ-{pt_bin}_MatchEWPDG20_TuneCP5_13TeV-amcatnloFXFX-pythia8_{era_settings['mc_dataset_postfix']}"
         process_name = "dyjets_"
         pt_bin_parts = pt_bin.split("To")
         if pt_bin_parts[1] == "Inf":
@@ -123,7 +184,7 @@ def add_datasets(analysis: od.Analysis, config: od.Config):
             id=dyjets.id + id,
             is_data=False,
             xsecs={
-                13: scinum.Number(dataset_db_entry["xsec"]),
+                13: sample_xsec(dataset_db_entry),
             },
             aux={
                 "generator_weight": dataset_db_entry["generator_weight"],
@@ -146,7 +207,7 @@ def add_datasets(analysis: od.Analysis, config: od.Config):
     # add ttbar samples
     for channel in ["Hadronic", "SemiLeptonic", "2L2Nu"]:
         # construct the dataset and process name
-        name = f"TTTo{channel}_TuneCP5_13TeV-powheg-pythia8_RunIISummer20UL18NanoAODv9-106X"
+        name = f"TTTo{channel}_TuneCP5_13TeV-powheg-pythia8_{era_settings['mc_dataset_postfix']}"
         process_name = "ttbar_"
         if channel == "Hadronic":
             process_name += "had"
@@ -164,7 +225,7 @@ def add_datasets(analysis: od.Analysis, config: od.Config):
             id=ttbar.id + id,
             is_data=False,
             xsecs={
-                13: scinum.Number(dataset_db_entry["xsec"]),
+                13: sample_xsec(dataset_db_entry),
             },
             aux={
                 "generator_weight": dataset_db_entry["generator_weight"],
@@ -218,6 +279,18 @@ def add_variables(analysis: od.Analysis, config: od.Config):
     )
 
 
+def apply_variable_overrides(analysis: od.Analysis, config: od.Config, override_files: List[str]):
+    # overrides are YAML files, e.g. written by the OptimizeBinning task, with the structure
+    # {"variables": {<name>: {<attribute>: <value>}}}; later files take precedence
+    for override_file in override_files:
+        with open(override_file, mode="r") as f:
+            overrides = yaml.safe_load(f) or {}
+        for name, attributes in overrides.get("variables", {}).items():
+            variable = config.get_variable(name)
+            for attribute, value in attributes.items():
+                setattr(variable, attribute, value)
+
+
 def add_channels(analysis: od.Analysis, config: od.Config):
     # di-muon channel
     config.add_channel(
@@ -281,19 +354,86 @@ def add_categories(analysis: od.Analysis, config: od.Config):
     ))
 
 
-# create the analysis and add all objects
-analysis = trigger_sf_analysis = od.Analysis(
-    name="boosted_tt_trigger_sf",
-    id=1,
-    aux={
-        "ntuple_tree": "ntuple",
-        "ntuple_base_path": "root://cmsdcache-kit-disk.gridka.de//store/user/mmolch/CROWN/ntuples/nmssm_2024-08_v1",
-        "sample_database_path": "/work/mmolch/xyh-bbtautau/KingMaker/sample_database/datasets.json",
-    },
-)
-config = config_2018 = add_config(analysis, 2018)
-add_variables(analysis, config)
-add_processes(analysis, config)
-add_datasets(analysis, config)
-add_channels(analysis, config)
-add_categories(analysis, config)
+def add_shifts(analysis: od.Analysis, config: od.Config):
+    # nominal shift, always present
+    config.add_shift(
+        name="nominal",
+        id=0,
+    )
+
+    # systematic shifts, which are booked with RDataFrame.Vary; 'weight' variations vary a weight before
+    # the total weight is built, 'column' variations vary an input column before any selection; expressions
+    # may contain placeholders, which are filled by the weight production (see util/rdf.py)
+
+    # normalization weight within the cross section uncertainty
+    for id, direction in [(1, "up"), (2, "down")]:
+        config.add_shift(
+            name=f"xsec_{direction}",
+            id=id,
+            type=od.Shift.RATE,
+            aux={
+                "kind": "weight",
+                "column": "norm_weight",
+                "type": "double",
+                "expression": f"norm_weight * {{xsec_{direction}_factor}}",
+                "mc_only": True,
+            },
+        )
+
+    # momentum scale of the leading muon, which effectively shifts the offline trigger thresholds
+    for id, (direction, factor) in [(3, ("up", 1.01)), (4, ("down", 0.99))]:
+        config.add_shift(
+            name=f"mu_pt_scale_{direction}",
+            id=id,
+            type=od.Shift.SHAPE,
+            aux={
+                "kind": "column",
+                "column": "pt_1",
+                "type": "float",
+                "expression": f"pt_1 * {factor}f",
+                "mc_only": True,
+            },
+        )
+
+
+@cache
+def get_analysis() -> od.Analysis:
+    # create the analysis and add all objects
+    analysis = od.Analysis(
+        name="boosted_tt_trigger_sf",
+        id=1,
+        aux={
+            "ntuple_tree": "ntuple",
+            "ntuple_base_path": "root://cmsdcache-kit-disk.gridka.de//store/user/mmolch/CROWN/ntuples/nmssm_2024-08_v1",
+            # alternative endpoints holding replicas of the ntuples, tried when a file cannot be read
+            "ntuple_replica_base_paths": [],
+            # summary tree with the number of generated events and the sum of generator weights per file
+            "event_count_tree": "Runs",
+            "event_count_branch": "genEventCount",
+            "event_sumw_branch": "genEventSumw",
+            "sample_database_path": "/work/mmolch/xyh-bbtautau/KingMaker/sample_database/datasets.json",
+        },
+    )
+
+    # add one config per era, the eras to set up can be restricted with a comma-separated list in TSF_ERAS,
+    # as the datasets of all set up eras have to be present in the sample database
+    override_files = [f for f in os.getenv("TSF_VARIABLE_OVERRIDES", "").split(":") if f]
+    for era in [e for e in os.getenv("TSF_ERAS", "2018").split(",") if e]:
+        config = add_config(analysis, era)
+        add_variables(analysis, config)
+        add_processes(analysis, config)
+        add_datasets(analysis, config)
+        add_channels(analysis, config)
+        add_categories(analysis, config)
+        add_shifts(analysis, config)
+        apply_variable_overrides(analysis, config, override_files)
+
+    return analysis
+
+
+def __getattr__(name: str) -> Any:
+    # the analysis is only built on first access, as this reads the sample database; importing the module,
+    # e.g. when law indexes the tasks, stays cheap
+    if name in ("analysis", "trigger_sf_analysis"):
+        return get_analysis()
+    raise AttributeError(f"module {__name__} has no attribute {name}")
@@ -7,9 +7,30 @@ import luigi
 import order as od
 import os
 
-from trigger_sf.config import trigger_sf_analysis
+from trigger_sf.config import get_analysis
+from trigger_sf.util.manifest import fingerprint, get_manifest
+from trigger_sf.util.metrics import get_registry, max_rss_bytes, metrics_enabled
+from trigger_sf.util.storage import STORAGE_PROFILES
 
-law.contrib.load("matplotlib", "numpy", "wlcg")
+
+class ManifestTargetMixin(object):
+
+    def __init__(self, *args, manifest_store=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.manifest_store = manifest_store or os.getenv("TSF_LOCAL_STORE")
+
+    def remove(self, *args, **kwargs):
+        # drop the output from the manifest, so that the owning task is not considered complete anymore
+        get_manifest(self.manifest_store).forget(self.abspath)
+        return super().remove(*args, **kwargs)
+
+
+class ManifestFileTarget(ManifestTargetMixin, law.LocalFileTarget):
+    pass
+
+
+class ManifestDirectoryTarget(ManifestTargetMixin, law.LocalDirectoryTarget):
+    pass
 
 
 class AnalysisTask(law.Task):
@@ -19,8 +40,36 @@ class AnalysisTask(law.Task):
         default="v1",
     )
 
+    manifest = luigi.BoolParameter(
+        description="check the completeness of the task with the output manifest of the local store instead of "
+        "querying each output on the filesystem; default: True",
+        default=True,
+        significant=False,
+    )
+
+    stat_outputs = luigi.BoolParameter(
+        description="when checking the completeness with the output manifest, additionally check the existence "
+        "of each output to detect outputs, which were deleted outside of law; default: True",
+        default=True,
+        significant=False,
+    )
+
+    content_addressed = luigi.BoolParameter(
+        description="include a hash of the configuration the outputs depend on in the output paths; default: True",
+        default=True,
+        significant=False,
+    )
+
     analysis = "xyh_bbtautau_trigger_sf"
 
+    # outputs of tasks, which are fully determined by their content hash, are stored independent of the
+    # version and can be shared via the store defined by TSF_SHARED_STORE
+    version_independent = False
+
+    # law contrib packages needed by the task, which are only loaded once the task is instantiated, so that
+    # indexing the tasks does not import them
+    contrib_packages = ()
+
     @classmethod
     def get_task_namespase(cls):
         return cls.analysis
@@ -28,8 +77,12 @@ class AnalysisTask(law.Task):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
+        # load the law contrib packages of this task
+        if self.contrib_packages:
+            law.contrib.load(*self.contrib_packages)
+
         # get the analysis instance
-        self.analysis_inst = trigger_sf_analysis
+        self.analysis_inst = get_analysis()
 
     @property
     def store_parts(self):
@@ -38,21 +91,192 @@ class AnalysisTask(law.Task):
     @property
     def store_parts_opt(self):
         parts = tuple()
-        if not law.is_no_param(self.version):
+        content_hash = self.content_hash if self.content_addressed else None
+        if not law.is_no_param(self.version) and not (self.version_independent and content_hash):
             parts += (self.version,)
+        if content_hash:
+            parts += (f"hash_{content_hash[:12]}",)
         return parts
 
+    def config_fingerprint(self):
+        # parts of the configuration, which determine the outputs of this task; None if not applicable
+        return None
+
+    def hashed_requirements(self):
+        # requirements, whose outputs determine the outputs of this task; must only depend on significant
+        # parameters, as the content hash is kept per task id
+        return self.requires()
+
+    # content hashes and requirement stores per task id, so that the requirement graph is only walked once
+    # per process and not on every call of output() or complete()
+    _content_hashes = {}
+    _requirement_stores = {}
+
+    # ids of tasks, which were found incomplete and did not start yet
+    _pending_tasks = set()
+
+    def _hash_requirements(self):
+        reqs = sorted(law.util.flatten(self.hashed_requirements()), key=lambda req: req.task_id)
+
+        # combine the own configuration fingerprint with the content hashes of all requirements
+        own = self.config_fingerprint()
+        req_hashes = sorted(
+            req.content_hash
+            for req in reqs
+            if isinstance(req, AnalysisTask) and req.content_hash
+        )
+        content_hash = None
+        if own is not None or req_hashes:
+            content_hash = fingerprint(self.task_family, own or "", req_hashes)
+        AnalysisTask._content_hashes[self.task_id] = content_hash
+
+        # stores, whose manifests hold the output hashes of the requirements; requirements that are not
+        # tracked by the manifest (e.g. external tasks) have no store
+        AnalysisTask._requirement_stores[self.task_id] = [
+            (req.task_id, req.store_root if isinstance(req, AnalysisTask) else None)
+            for req in reqs
+        ]
+
+    @property
+    def content_hash(self):
+        if self.task_id not in AnalysisTask._content_hashes:
+            self._hash_requirements()
+        return AnalysisTask._content_hashes[self.task_id]
+
+    @property
+    def requirement_stores(self):
+        if self.task_id not in AnalysisTask._requirement_stores:
+            self._hash_requirements()
+        return AnalysisTask._requirement_stores[self.task_id]
+
+    @property
+    def store_root(self):
+        store = os.getenv("TSF_LOCAL_STORE")
+        if self.version_independent and self.content_addressed and self.content_hash:
+            store = os.getenv("TSF_SHARED_STORE") or store
+        return store
+
     @property
     def local_store(self):
-        parts = (os.getenv("TSF_LOCAL_STORE"), ) + self.store_parts + self.store_parts_opt
+        parts = (self.store_root, ) + self.store_parts + self.store_parts_opt
         return os.path.join(*parts)
 
     def local_path(self, *parts):
         return os.path.join(self.local_store, *[str(part) for part in parts])
 
     def local_target(self, *parts, **kwargs):
-        target_cls = law.LocalDirectoryTarget if kwargs.pop("is_dir", False) else law.LocalFileTarget
-        return target_cls(self.local_path(*parts))
+        target_cls = ManifestDirectoryTarget if kwargs.pop("is_dir", False) else ManifestFileTarget
+        return target_cls(self.local_path(*parts), manifest_store=self.store_root)
+
+    @property
+    def output_manifest(self):
+        # outputs in the shared store are recorded in the manifest of the shared store
+        return get_manifest(self.store_root)
+
+    def manifest_outputs(self):
+        # get the paths of all outputs, or None if any output is not tracked by the manifest
+        outputs = law.util.flatten(self.output())
+        if not outputs or not all(isinstance(output, ManifestTargetMixin) for output in outputs):
+            return None
+        return [output.abspath for output in outputs]
+
+    def manifest_input_hash(self):
+        # combine the recorded output hashes of all requirements, which are looked up by their task id
+        # without instantiating the requirements again; untracked requirements only enter via their task id
+        req_hashes = []
+        for task_id, store in self.requirement_stores:
+            output_hash = get_manifest(store).output_hash(task_id) if store else None
+            req_hashes.append(f"{task_id}:{output_hash or ''}")
+        return fingerprint(self.task_id, req_hashes)
+
+    def complete(self):
+        complete = self.manifest_complete()
+
+        # tasks, which are found incomplete while scheduling, are pending until they start; external tasks
+        # are never run
+        pending = not complete and not isinstance(self, law.ExternalTask)
+        if pending and metrics_enabled() and self.task_id not in AnalysisTask._pending_tasks:
+            AnalysisTask._pending_tasks.add(self.task_id)
+            get_registry().add(
+                "tsf_tasks_pending",
+                1,
+                help="number of incomplete tasks, which did not start yet",
+                task_family=self.task_family,
+            )
+
+        return complete
+
+    def manifest_complete(self):
+        # wrapper and external tasks are handled as usual
+        if not self.manifest or isinstance(self, (luigi.WrapperTask, law.ExternalTask)):
+            return super().complete()
+
+        paths = self.manifest_outputs()
+        if paths is None:
+            return super().complete()
+
+        # outputs written before the manifest existed fall back to the filesystem check
+        state = self.output_manifest.check(self.task_id, self.manifest_input_hash(), paths)
+        if state is None:
+            return super().complete()
+
+        # a single stat per output detects outputs, which were deleted outside of law
+        if state and self.stat_outputs:
+            return all(os.path.exists(path) for path in paths)
+        return state
+
+
+@AnalysisTask.event_handler(luigi.Event.SUCCESS)
+def record_outputs(task):
+    if not task.manifest or isinstance(task, (luigi.WrapperTask, law.ExternalTask)):
+        return
+
+    # record the outputs together with the fingerprint of the inputs they were produced from
+    paths = task.manifest_outputs()
+    if paths is not None:
+        task.output_manifest.record(task.task_id, task.manifest_input_hash(), paths)
+
+
+@AnalysisTask.event_handler(luigi.Event.START)
+def metrics_start(task):
+    registry = get_registry()
+    if task.task_id in AnalysisTask._pending_tasks:
+        AnalysisTask._pending_tasks.discard(task.task_id)
+        registry.add(
+            "tsf_tasks_pending",
+            -1,
+            help="number of incomplete tasks, which did not start yet",
+            task_family=task.task_family,
+        )
+    registry.inc("tsf_tasks_started_total", help="number of started tasks", task_family=task.task_family)
+    registry.add("tsf_tasks_running", 1, help="number of running tasks", task_family=task.task_family)
+
+
+@AnalysisTask.event_handler(luigi.Event.SUCCESS)
+@AnalysisTask.event_handler(luigi.Event.FAILURE)
+def metrics_end(task, *args):
+    registry = get_registry()
+    status = "failure" if args else "success"
+    registry.inc(
+        "tsf_tasks_finished_total",
+        help="number of finished tasks",
+        task_family=task.task_family,
+        status=status,
+    )
+    registry.add("tsf_tasks_running", -1, help="number of running tasks", task_family=task.task_family)
+    rss = max_rss_bytes()
+    if rss is not None:
+        registry.set("tsf_process_max_rss_bytes", rss, help="peak resident memory of the worker process")
+
+
+@AnalysisTask.event_handler(luigi.Event.PROCESSING_TIME)
+def metrics_processing_time(task, processing_time):
+    get_registry().observe(
+        "tsf_task_duration_seconds",
+        processing_time,
+        help="run time of tasks",
+        task_family=task.task_family,
+    )
 
 
 class ConfigTask(AnalysisTask):
@@ -120,8 +344,38 @@ class EfficiencyTask(ConfigTask):
         description="name of the category, which represents the reference+signal dataset of the trigger efficiency measurement; must be a subset of the reference category",
     )
 
+    n_replicas = luigi.IntParameter(
+        description="number of Poisson bootstrap replicas filled alongside the nominal histograms; default: 0",
+        default=0,
+    )
+
+    shifts = law.CSVParameter(
+        description="comma-separated list of systematic shifts evaluated alongside the nominal efficiencies; "
+        "default: empty",
+        default=(),
+    )
+
+    storage = luigi.ChoiceParameter(
+        description="storage profile of the filled histograms, see util/histograms.py; default: weight",
+        choices=STORAGE_PROFILES,
+        default="weight",
+    )
+
+    configs = law.CSVParameter(
+        description="comma-separated list of configs, whose histograms are merged to combine their eras; the "
+        "variables, categories and processes are taken from --config; default: only --config",
+        default=(),
+    )
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
+
+        # sort shift names, the nominal shift is always included
+        self.shifts = tuple(sorted(set(self.shifts) - {"nominal"}))
+
+        # sort config names, the main config is always included
+        self.configs = tuple(sorted(set(self.configs) | {self.config}))
+        self.config_insts = [self.analysis_inst.get_config(c) for c in self.configs]
         
         # get the channel instance
         self.channel_inst = self.config_inst.get_channel(self.channel)
@@ -143,6 +397,20 @@ class EfficiencyTask(ConfigTask):
             [self.config_inst.get_process(v) for v in self.processes],
         )
 
+    @property
+    def config_dataset_names(self):
+        # names of all configs and their datasets, whose process belongs to one of the selected processes
+        return [
+            (config_inst.name, d.name)
+            for config_inst in self.config_insts
+            for d in config_inst.datasets.values()
+            if any([list(d.processes.values())[0].has_parent_process(p.name) for p in self.process_insts])
+        ]
+
+    @property
+    def lumi(self):
+        return sum(config_inst.campaign.x.lumi for config_inst in self.config_insts)
+
     @property
     def categories_string(self):
         return "__".join([self.ref_category, self.sig_ref_category])
@@ -175,8 +443,22 @@ class EfficiencyTask(ConfigTask):
 
     @property
     def store_parts(self):
-        return super().store_parts + (self.channel, self.categories_string, self.variables_string, self.processes_string)
+        parts = super().store_parts
+        if len(self.configs) > 1:
+            parts += ("configs_" + "__".join(self.configs), )
+        parts += (self.channel, self.categories_string, self.variables_string, self.processes_string)
+        if self.n_replicas > 0:
+            parts += (f"replicas_{self.n_replicas}", )
+        if self.shifts:
+            parts += ("shifts_" + "__".join(self.shifts), )
+        if self.storage != "weight":
+            parts += (f"storage_{self.storage}", )
+        return parts
 
     @property
     def variations(self):
-        return ["nominal", "up", "down"]
+        variations = ["nominal", "up", "down"]
+        if self.n_replicas > 0:
+            variations += ["bootstrap_up", "bootstrap_down"]
+        variations += list(self.shifts)
+        return variations
@@ -0,0 +1,83 @@
+import luigi
+
+from trigger_sf.tasks.base import EfficiencyTask
+from trigger_sf.tasks.histograms import CreateHistograms
+
+
+class OptimizeBinning(EfficiencyTask):
+
+    fine_binning = luigi.IntParameter(
+        description="number of equidistant fine bins per variable, which are merged by the optimization; "
+        "default: 100",
+        default=100,
+    )
+
+    min_entries = luigi.FloatParameter(
+        description="minimum number of effective entries of the reference category per bin; default: 20",
+        default=20.0,
+    )
+
+    max_rel_unc = luigi.FloatParameter(
+        description="maximum relative uncertainty of the efficiency per bin; default: 0.1",
+        default=0.1,
+    )
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        # the optimization needs the variances of the reference histograms, which the double storage does
+        # not keep for weighted MC
+        if self.storage == "double" and len(self.mc_process_insts) > 0:
+            raise ValueError("the double storage has no variances of weighted MC, use another storage profile")
+
+    def requires(self):
+        return [
+            CreateHistograms.req(self, config=config, dataset=dataset, category=category, fine_binning=self.fine_binning)
+            for config, dataset in self.config_dataset_names
+            for category in [self.ref_category_inst.name, self.sig_ref_category_inst.name]
+        ]
+
+    @property
+    def store_parts(self):
+        return super().store_parts + (f"fine_{self.fine_binning}", f"min_{self.min_entries}__rel_{self.max_rel_unc}")
+
+    def output(self):
+        return self.local_target("binning.yaml")
+
+    def run(self):
+        import hist
+        from trigger_sf.util.binning import optimize_binning
+        from trigger_sf.util.histograms import as_weight_storage, merge_histograms
+
+        # sum histograms, the optimization needs the variances
+        histogram = as_weight_storage(merge_histograms(
+            input["histogram"].load(formatter="pickle")
+            for input in self.input()
+        ))
+
+        # fine-binned sums of the selected processes, without under- and overflow
+        processes = [p.name for p in self.process_insts]
+        h_ref = histogram[self.ref_category, processes, ...][hist.sum, ...]
+        h_sig_ref = histogram[self.sig_ref_category, processes, ...][hist.sum, ...]
+        fine_edges = [h_ref.axes[v.name].edges for v in self.variable_insts]
+
+        # search the merged binning
+        edges = optimize_binning(
+            fine_edges,
+            h_ref.values(),
+            h_ref.variances(),
+            h_sig_ref.values(),
+            min_entries=self.min_entries,
+            max_rel_unc=self.max_rel_unc,
+        )
+
+        # save the binning as a variable override, which can be loaded via TSF_VARIABLE_OVERRIDES
+        self.output().dump(
+            {
+                "variables": {
+                    v.name: {"binning": _edges}
+                    for v, _edges in zip(self.variable_insts, edges)
+                },
+            },
+            formatter="yaml",
+        )
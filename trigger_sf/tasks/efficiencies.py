@@ -4,12 +4,13 @@ import order as od
 
 from trigger_sf.tasks.base import EfficiencyTask
 from trigger_sf.tasks.histograms import CreateHistograms
-
-law.contrib.load("numpy")
+from trigger_sf.util.metrics import get_registry
 
 
 class CalculateEfficiencies(EfficiencyTask):
 
+    contrib_packages = ("numpy", )
+
     channel = law.Parameter(
         description="name of the channel",
     )
@@ -31,14 +32,9 @@ class CalculateEfficiencies(EfficiencyTask):
     )
 
     def requires(self):
-        datasets = [
-            d.name
-            for d in self.config_inst.datasets.values()
-            if any([list(d.processes.values())[0].has_parent_process(p) for p in self.process_insts])
-        ]
         return [
-            CreateHistograms.req(self, dataset=dataset, category=category)
-            for dataset in datasets
+            CreateHistograms.req(self, config=config, dataset=dataset, category=category)
+            for config, dataset in self.config_dataset_names
             for category in [self.ref_category_inst.name, self.sig_ref_category_inst.name]
         ]
 
@@ -46,39 +42,25 @@ class CalculateEfficiencies(EfficiencyTask):
         return self.local_target("efficiencies.npz")
 
     def run(self):
-        import hist.intervals
-        import numpy as np
+        from trigger_sf.util.histograms import calculate_efficiencies, merge_histograms
+
+        registry = get_registry()
+        stage_help = "time spent in the stages of a task"
 
         # load histograms
-        histograms = []
-        for input in self.input():
-            histograms.append(input.load(formatter="pickle"))
+        with registry.timer("tsf_stage_seconds", help=stage_help, task_family=self.task_family, stage="load"):
+            histograms = []
+            for input in self.input():
+                histograms.append(input["histogram"].load(formatter="pickle"))
 
         # sum histograms
-        histogram = None
-        for h in histograms:
-            if histogram is None:
-                histogram = h
-            else:
-                histogram += h
-
-        # get histogram for ref and for sig_ref category
+        with registry.timer("tsf_stage_seconds", help=stage_help, task_family=self.task_family, stage="merge"):
+            histogram = merge_histograms(histograms)
+
+        # calculate efficiencies and uncertainties for the selected processes
         processes = [p.name for p in self.process_insts]
-        h_ref = histogram[self.ref_category, processes, ...][hist.sum, ...]
-        h_sig_ref = histogram[self.sig_ref_category, processes, ...][hist.sum, ...]
-
-        # divide histograms
-        eff_nominal = h_sig_ref.values() / h_ref.values()
-        eff_shift = hist.intervals.clopper_pearson_interval(h_sig_ref.values(), h_ref.values(), coverage=0.68)
-        eff_down = eff_shift[0, ...]
-        eff_up = eff_shift[1, ...]
-
-        # prepare arrays for saving them in an .npz file
-        data = {
-            "nominal": eff_nominal,
-            "up": eff_up,
-            "down": eff_down,
-        }
+        with registry.timer("tsf_stage_seconds", help=stage_help, task_family=self.task_family, stage="compute"):
+            data = calculate_efficiencies(histogram, self.ref_category, self.sig_ref_category, processes)
 
         # save efficiencies and uncertainties
         self.output().dump(**data, formatter="numpy")
@@ -86,6 +68,8 @@ class CalculateEfficiencies(EfficiencyTask):
 
 class PlotEfficiencies(EfficiencyTask):
 
+    contrib_packages = ("matplotlib", "numpy")
+
     extensions = law.CSVParameter(
         description="extensions of the image file to be produced; default: 'png,pdf'",
         default=["png", "pdf"]
@@ -103,16 +87,11 @@ class PlotEfficiencies(EfficiencyTask):
             for extension in self.extensions
         }
 
-    def run(self):
+    def create_figures(self, efficiency):
         # delayed imports, as packages are only needed for this task
-        import matplotlib as mpl
-        import mplhep
         import numpy as np
         from trigger_sf.util.plotting import plot_2d_colormesh
 
-        # load efficiency dictionary
-        efficiency = self.input()["CalculateEfficiencies"].load(formatter="numpy")
-
         # variable bin edges and labels
         variable_insts = list(self.variable_insts.values())
         x_bin_edges = np.array(variable_insts[0].bin_edges)
@@ -129,27 +108,49 @@ class PlotEfficiencies(EfficiencyTask):
 
         # keyword arguments for cms label command
         mplhep_label_kwargs = {
-            "lumi": self.campaign_inst.x.lumi,
+            "lumi": self.lumi,
             "fontsize": 22,
         }
 
-        # produce the efficiency plot
+        # produce the plot of each variation, must be called within the plot style context
+        for variation in self.variations:
+            # colorbar label
+            z_label = f"$\\epsilon$ ({variation}, {self.processes_label})"
+
+            # create the plot
+            fig, ax = plot_2d_colormesh(
+                x_bin_edges,
+                y_bin_edges,
+                efficiency[variation],
+                x_label,
+                y_label,
+                z_label,
+                pcolormesh_kwargs=pcolormesh_kwargs,
+                mplhep_label_kwargs=mplhep_label_kwargs,
+            )
+
+            yield variation, fig
+
+    def run(self):
+        # delayed imports, as packages are only needed for this task
+        import matplotlib as mpl
+        import matplotlib.pyplot as plt
+        import mplhep
+
+        # load efficiency dictionary
+        efficiency = self.input()["CalculateEfficiencies"].load(formatter="numpy")
+
+        # produce and save the plots
+        registry = get_registry()
         with mpl.style.context(mplhep.style.CMS):
-            for variation in self.variations:
-                # colorbar label
-                z_label = f"$\\epsilon$ ({variation}, {self.processes_label})"
-
-                # create the plot
-                fig, ax = plot_2d_colormesh(
-                    x_bin_edges,
-                    y_bin_edges,
-                    efficiency[variation],
-                    x_label,
-                    y_label,
-                    z_label,
-                    pcolormesh_kwargs=pcolormesh_kwargs,
-                    mplhep_label_kwargs=mplhep_label_kwargs,
+            for variation, fig in self.create_figures(efficiency):
+                figure_timer = registry.timer(
+                    "tsf_figure_save_seconds",
+                    help="time to save a figure in all formats",
+                    task_family=self.task_family,
                 )
-
-                for extension in self.extensions:
-                    self.output()[(variation, extension)].dump(fig, formatter="mpl")
+                with figure_timer:
+                    for extension in self.extensions:
+                        self.output()[(variation, extension)].dump(fig, formatter="mpl")
+                registry.inc("tsf_figures_total", help="number of saved figures", task_family=self.task_family)
+                plt.close(fig)
@@ -1,17 +1,24 @@
 import law
+import luigi
 import order as od
+import os
+import time
 
+from trigger_sf.config import sample_database
 from trigger_sf.tasks.base import DatasetTask
-
-law.contrib.load("wlcg")
+from trigger_sf.util.manifest import fingerprint
+from trigger_sf.util.metrics import get_registry, metrics_enabled
+from trigger_sf.util.storage import STORAGE_PROFILES
 
 
 class NTupleFiles(DatasetTask, law.ExternalTask):
 
+    contrib_packages = ("wlcg", )
+
     def output(self):
         # get the base directory for the NTuple files related to this dataset
         ntuple_dir = law.wlcg.WLCGDirectoryTarget(
-            f"CROWNRun/{self.campaign_inst.x.year}/{self.dataset_inst.name}/{self.channel_inst.name}",
+            f"CROWNRun/{self.campaign_inst.x.era}/{self.dataset_inst.name}/{self.channel_inst.name}",
             fs="wlcg_fs_ntuple",
         )
 
@@ -21,7 +28,150 @@ class NTupleFiles(DatasetTask, law.ExternalTask):
         return ntuple_files
 
 
-class CreateHistograms(DatasetTask):
+class NTupleMetadata(DatasetTask):
+
+    def requires(self):
+        return {
+            "NTupleFiles": NTupleFiles.req(self),
+        }
+
+    def output(self):
+        return self.local_target("metadata.json")
+
+    def run(self):
+        from trigger_sf.util.files import read_event_counts
+
+        # read the event counts of each file from its summary tree, which does not need an event loop; data
+        # has no generated events, so its files are not opened
+        files = {}
+        for target in self.input()["NTupleFiles"]:
+            if self.process_inst is not None and self.process_inst.is_data:
+                files[target.uri()] = None
+                continue
+            # files, which cannot be read, have unknown counts, so that the histograms of the dataset fall back
+            # to the normalization with the number of events of the sample database
+            try:
+                files[target.uri()] = read_event_counts(
+                    target.uri(),
+                    self.analysis_inst.x.event_count_tree,
+                    self.analysis_inst.x.event_count_branch,
+                    self.analysis_inst.x.event_sumw_branch,
+                )
+            except Exception as e:
+                self.logger.warning(f"cannot read event counts of {target.uri()}: {e}")
+                files[target.uri()] = None
+
+        # store the counts together with the file listing
+        self.output().dump({"files": files}, formatter="json")
+
+
+class NTupleSelectionIndex(DatasetTask):
+
+    contrib_packages = ("numpy", )
+
+    def requires(self):
+        return {
+            "NTupleFiles": NTupleFiles.req(self),
+        }
+
+    @property
+    def indexed_cuts(self):
+        from trigger_sf.util.rdf import record_graph
+        from trigger_sf.util.selection_index import indexable_cuts
+
+        # the cuts of all categories of the channel, without systematic shifts
+        return indexable_cuts(
+            record_graph({
+                "campaign": self.campaign_inst,
+                "channel": self.channel_inst,
+                "category": category_inst,
+                "dataset": self.dataset_inst,
+                "process": self.process_inst,
+                "shifts": [],
+            })
+            for category_inst in self.channel_inst.categories.values()
+        )
+
+    def config_fingerprint(self):
+        defines, cuts = self.indexed_cuts
+        return fingerprint([repr(op) for op in defines], sorted(cuts.items()), self.analysis_inst.x.ntuple_tree)
+
+    def output(self):
+        return {
+            "index": self.local_target("selection_index.json"),
+            "masks": self.local_target("selection_masks.npz"),
+        }
+
+    def run(self):
+        from trigger_sf.util.selection_index import compute_masks
+
+        # evaluate all cuts once per file, files are identified by their name within the dataset directory
+        defines, cuts = self.indexed_cuts
+        files, masks = {}, {}
+        targets = self.input()["NTupleFiles"]
+        for i, target in enumerate(targets):
+            result = compute_masks(target.uri(), self.analysis_inst.x.ntuple_tree, defines, cuts)
+            files[target.basename] = {"id": i, "n_entries": result["n_entries"]}
+            for key, mask in result["masks"].items():
+                masks[f"{i}__{key}"] = mask
+            self.publish_progress(100.0 * (i + 1) / len(targets))
+
+        # the masks of all files are stored in one archive, described by the index
+        self.output()["index"].dump({"cuts": cuts, "files": files}, formatter="json")
+        self.output()["masks"].dump(**masks, formatter="numpy")
+
+
+class NormalizationMixin(object):
+    """
+    Mixin for tasks requiring NTupleFiles and NTupleMetadata, which determines the inputs of the
+    normalization of MC events from the event counts of the processed files.
+    """
+
+    def load_normalization(self, ntuple_targets, ntuple_files):
+        # sum the event counts of the processed files for the normalization
+        metadata = self.input()["NTupleMetadata"].load(formatter="json")["files"]
+        self.processed_fraction = self.processed_fraction_of(metadata, ntuple_targets, ntuple_files)
+        self.event_sums = self.processed_event_sums(metadata, ntuple_targets, ntuple_files)
+
+    def processed_fraction_of(self, metadata, ntuple_targets, ntuple_files):
+        # fraction of the generated events contained in the processed files; if the event counts are not
+        # known for all files, all files are assumed to contain the same number of events
+        if not ntuple_targets:
+            return 1.0
+        counts = {t.uri(): metadata.get(t.uri()) for t in ntuple_targets}
+        if all(counts.values()) and sum(c["n_events"] for c in counts.values()) > 0:
+            return sum(counts[f]["n_events"] for f in ntuple_files) / sum(c["n_events"] for c in counts.values())
+        return len(ntuple_files) / len(ntuple_targets)
+
+    def processed_event_sums(self, metadata, ntuple_targets, ntuple_files):
+        # validate the file listing against the sample database
+        if set(metadata.keys()) != set(t.uri() for t in ntuple_targets):
+            self.logger.warning("file listing changed since the metadata was read")
+        counts = list(metadata.values())
+        if counts and all(counts):
+            n_events = sum(c["n_events"] for c in counts)
+            if n_events != self.dataset_inst.n_events:
+                self.logger.warning(
+                    f"files contain {n_events} generated events, sample database states "
+                    f"{self.dataset_inst.n_events}",
+                )
+
+        # the sums are only usable if they are known for all processed files
+        processed = [metadata.get(f) for f in ntuple_files]
+        if not processed or not all(processed) or any(c["sum_gen_weights"] is None for c in processed):
+            return None
+        return {
+            "n_events": sum(c["n_events"] for c in processed),
+            "sum_gen_weights": sum(c["sum_gen_weights"] for c in processed),
+        }
+
+
+class CreateHistograms(NormalizationMixin, DatasetTask):
+
+    # histograms are fully determined by the configuration hash and can be shared across versions
+    version_independent = True
+
+    contrib_packages = ("numpy", )
 
     category = law.Parameter(
         description="name of the category",
@@ -31,12 +181,105 @@ class CreateHistograms(DatasetTask):
         description="list of variables",
     )
 
+    n_replicas = luigi.IntParameter(
+        description="number of Poisson bootstrap replicas filled alongside the nominal histogram; default: 0",
+        default=0,
+    )
+
+    shifts = law.CSVParameter(
+        description="comma-separated list of systematic shifts booked in the same event loop; default: empty",
+        default=(),
+    )
+
+    storage = luigi.ChoiceParameter(
+        description="storage profile of the histogram, see util/histograms.py for the memory and accuracy "
+        "trade-off of each profile; default: weight",
+        choices=STORAGE_PROFILES,
+        default="weight",
+    )
+
+    tree_cache_size = luigi.IntParameter(
+        description="size of the TTree cache for the planned branches in MB; default: 100",
+        default=100,
+        significant=False,
+    )
+
+    fine_binning = luigi.IntParameter(
+        description="if positive, replace the binning of each variable by this number of equidistant bins "
+        "within the range of its configured binning; default: 0",
+        default=0,
+    )
+
+    checkpoint_files = luigi.IntParameter(
+        description="number of files processed between two checkpoints of the partially filled histogram, from "
+        "which a restarted job resumes; 0 disables checkpointing; default: 0",
+        default=0,
+        significant=False,
+    )
+
+    file_timeout = luigi.FloatParameter(
+        description="timeout in seconds for opening a single ntuple file; default: 60",
+        default=60.0,
+        significant=False,
+    )
+
+    file_retries = luigi.IntParameter(
+        description="number of retries per file and endpoint before switching to the next one; default: 2",
+        default=2,
+        significant=False,
+    )
+
+    file_check_workers = luigi.IntParameter(
+        description="number of subprocesses, which check the files concurrently before the event loop; default: 8",
+        default=8,
+        significant=False,
+    )
+
+    allow_skip_files = luigi.BoolParameter(
+        description="skip files, which cannot be read from any endpoint, and record them instead of failing; "
+        "the normalization of MC is corrected for the skipped files; default: False",
+        default=False,
+    )
+
+    selection_index = luigi.BoolParameter(
+        description="read only the entries passing the cuts of the selection index of the dataset instead of "
+        "evaluating them event by event; not used for systematic shifts; default: False",
+        default=False,
+        significant=False,
+    )
+
+    workers = luigi.IntParameter(
+        description="number of workers, which fill balanced chunks of the entries in parallel; 0 fills all "
+        "entries in this process; default: 0",
+        default=0,
+        significant=False,
+    )
+
+    backend = luigi.ChoiceParameter(
+        description="backend of the workers, local processes or a Dask cluster; default: processes",
+        choices=("processes", "dask"),
+        default="processes",
+        significant=False,
+    )
+
+    dask_scheduler = luigi.Parameter(
+        description="address of the Dask scheduler; default: empty, a LocalCluster is started",
+        default="",
+        significant=False,
+    )
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
         # get category instance
         self.category_inst = self.config_inst.get_category(self.category)
 
+        # get shift instances, variations are filled with RDataFrame histograms, which do not support replicas
+        self.shifts = tuple(sorted(set(self.shifts) - {"nominal"}))
+        self.shift_insts = [self.config_inst.get_shift(s) for s in self.shifts]
+        if self.shift_insts and self.n_replicas > 0:
+            raise ValueError("systematic shifts cannot be combined with bootstrap replicas")
+
         # get variable instances and sort variable names
         self.variable_insts = od.UniqueObjectIndex(
             od.Variable,
@@ -49,37 +292,437 @@ class CreateHistograms(DatasetTask):
 
     @property
     def store_parts(self):
-        return super().store_parts + (self.category, self.variables_string)
+        parts = super().store_parts + (self.category, self.variables_string)
+        if self.n_replicas > 0:
+            parts += (f"replicas_{self.n_replicas}", )
+        if self.shifts:
+            parts += ("shifts_" + "__".join(self.shifts), )
+        if self.fine_binning > 0:
+            parts += (f"fine_{self.fine_binning}", )
+        if self.storage != "weight":
+            parts += (f"storage_{self.storage}", )
+        # histograms with skipped files are incomplete and must not be taken for the ones of a strict run
+        if self.allow_skip_files:
+            parts += ("allow_skip_files", )
+        return parts
+
+    @property
+    def binnings(self):
+        # binning overrides of the variables
+        if self.fine_binning <= 0:
+            return {}
+        return {
+            v.name: [
+                v.bin_edges[0] + i * (v.bin_edges[-1] - v.bin_edges[0]) / self.fine_binning
+                for i in range(self.fine_binning + 1)
+            ]
+            for v in self.variable_insts
+        }
+
+    @property
+    def recorded_operations(self):
+        from trigger_sf.util.rdf import record_graph
+
+        # selection and weight expressions as they would be applied to the events
+        if getattr(self, "_recorded_operations", None) is None:
+            self._recorded_operations = record_graph({
+                "campaign": self.campaign_inst,
+                "channel": self.channel_inst,
+                "category": self.category_inst,
+                "dataset": self.dataset_inst,
+                "process": self.process_inst,
+                "shifts": self.shift_insts,
+            })
+        return self._recorded_operations
+
+    @property
+    def selection_is_empty(self):
+        from trigger_sf.util.rdf import selection_is_empty
+
+        return selection_is_empty(self.recorded_operations)
 
     def requires(self):
+        # no files are needed if the selection is known to reject all events
+        if self.selection_is_empty:
+            return {}
+
+        reqs = {
+            "NTupleFiles": NTupleFiles.req(self),
+            "NTupleMetadata": NTupleMetadata.req(self),
+        }
+        if self.selection_index:
+            reqs["NTupleSelectionIndex"] = NTupleSelectionIndex.req(self)
+        return reqs
+
+    def hashed_requirements(self):
+        # the selection index only changes which entries are read, not the filled histogram
+        reqs = dict(self.requires())
+        reqs.pop("NTupleSelectionIndex", None)
+        return reqs
+
+    def config_fingerprint(self):
+        operations = self.recorded_operations
+
+        # variable expressions and binnings
+        variables = [
+            (v.name, v.expression, tuple(self.binnings.get(v.name, v.bin_edges)))
+            for v in self.variable_insts
+        ]
+
+        # the histogram axes depend on all categories and processes of the config
+        axes = (tuple(self.config_inst.categories.names()), tuple(self.config_inst.processes.names()))
+
+        # the sample database entry of the dataset
+        db_entry = sample_database(self.analysis_inst.x.sample_database_path).get(self.dataset_inst.name, {})
+
+        return fingerprint(
+            [repr(op) for op in operations],
+            [repr(v) for v in variables],
+            repr(axes),
+            self.storage,
+            repr(sorted(db_entry.items())),
+            self.analysis_inst.x.ntuple_tree,
+        )
+
+    @property
+    def storage_kwargs(self):
         return {
-            "NTupleFiles": NTupleFiles.req(self)
+            "storage": self.storage,
+            "is_data": self.process_inst.is_data,
+            "categories": [self.category_inst.name],
+            "processes": [self.process_inst.get_root_processes()[0].name],
         }
 
     def output(self):
-        return self.local_target("histogram.pickle")
+        return {
+            "histogram": self.local_target("histogram.pickle"),
+            "skipped_files": self.local_target("skipped_files.json"),
+        }
+
+    @property
+    def checkpoint_target(self):
+        return self.local_target("histogram.checkpoint.pickle")
+
+    def resolve_files(self, ntuple_targets):
+        from concurrent.futures import ThreadPoolExecutor
+        from trigger_sf.util.files import check_files, replica_uris, resolve_file
+
+        base = self.analysis_inst.x.ntuple_base_path
+        replica_bases = self.analysis_inst.x("ntuple_replica_base_paths", [])
+        local_cache = os.path.join(
+            os.getenv("TSF_LOCAL_STORE"), ".ntuple_cache", self.config, self.channel, self.dataset,
+        )
+
+        def local_copy(target):
+            # fetch the file to the local cache, unless a copy exists already
+            def fetch():
+                path = os.path.join(local_cache, target.basename)
+                if not os.path.exists(path):
+                    os.makedirs(local_cache, exist_ok=True)
+                    target.copy_to_local(path + ".tmp")
+                    os.replace(path + ".tmp", path)
+                return path
+            return fetch
+
+        def resolve(target):
+            uri = target.uri()
+            candidates = [uri] + replica_uris(uri, base, replica_bases) + [local_copy(target)]
+            return resolve_file(
+                candidates,
+                self.analysis_inst.x.ntuple_tree,
+                timeout=self.file_timeout,
+                retries=self.file_retries,
+            )
+
+        def check(batch):
+            return check_files(batch, self.analysis_inst.x.ntuple_tree, self.file_timeout)
+
+        # check the files in batches with one subprocess each, and resolve only the files, which failed, one
+        # by one with retries and a fall back to replicas and a local copy; the numbers of entries of the
+        # usable files are kept for splitting them among workers
+        n_batches = max(self.file_check_workers, 1)
+        uris = [target.uri() for target in ntuple_targets]
+        with ThreadPoolExecutor(n_batches) as pool:
+            checked = {}
+            for entries in pool.map(check, [uris[i::n_batches] for i in range(n_batches)]):
+                checked.update(entries)
+            failed = [target for target in ntuple_targets if target.uri() not in checked]
+            resolved_failed = dict(zip([target.uri() for target in failed], pool.map(resolve, failed)))
+        results = [
+            (uri, checked[uri]) if uri in checked else resolved_failed[uri]
+            for uri in uris
+        ]
+
+        resolved, skipped = {}, []
+        self.file_entries = {}
+        for target, result in zip(ntuple_targets, results):
+            uri = target.uri()
+            if result is not None:
+                resolved[uri], self.file_entries[result[0]] = result
+            elif self.allow_skip_files:
+                self.publish_message(f"skipping unreadable file {uri}")
+                skipped.append(uri)
+            else:
+                raise IOError(f"cannot read {uri} from any endpoint")
+
+        return resolved, skipped
 
     def run(self):
-        # delayed imports, as packages are only needed for this task
+        # statically empty selections result in an empty histogram without reading any file
+        if self.selection_is_empty:
+            self.publish_message("selection rejects all events, writing an empty histogram")
+            self.output()["skipped_files"].dump(
+                {"files": [], "n_files": 0, "processed_fraction": 1.0},
+                formatter="json",
+            )
+            self.output()["histogram"].dump(self.fill_histogram([]), formatter="pickle")
+            return
+
+        # get list of ntuple files and resolve the location to read each of them from
+        ntuple_targets = self.input()["NTupleFiles"]
+        resolved, skipped = self.resolve_files(ntuple_targets)
+        ntuple_files = list(resolved.keys())
+
+        # sum the event counts of the processed files for the normalization
+        self.load_normalization(ntuple_targets, ntuple_files)
+
+        # record skipped files, so that they can be taken into account downstream
+        self.output()["skipped_files"].dump(
+            {"files": skipped, "n_files": len(ntuple_targets), "processed_fraction": self.processed_fraction},
+            formatter="json",
+        )
+
+        # without checkpointing, all files are processed in a single event loop
+        if self.checkpoint_files <= 0:
+            h = self.fill_events([resolved[f] for f in ntuple_files])
+            self.output()["histogram"].dump(h, formatter="pickle")
+            return
+
+        # resume from the last checkpoint of a previous attempt
+        h, done_files = None, []
+        checkpoint = self.checkpoint_target
+        if checkpoint.exists():
+            try:
+                state = checkpoint.load(formatter="pickle")
+                h, done_files = state["histogram"], list(state["files"])
+            except Exception as e:
+                # e.g. a checkpoint truncated by a full disk
+                self.publish_message(f"ignoring unreadable checkpoint: {e}")
+                h, done_files = None, []
+
+        # the histogram of a checkpoint with files, which are not part of the current listing anymore, cannot
+        # be used, as their events cannot be subtracted again
+        if set(done_files) - set(ntuple_files):
+            self.publish_message("ignoring checkpoint, which contains files not in the current file list")
+            h, done_files = None, []
+        elif done_files:
+            self.publish_message(f"resuming from checkpoint with {len(done_files)}/{len(ntuple_files)} files done")
+
+        # process the remaining files in chunks and save a checkpoint after each chunk
+        done_set = set(done_files)
+        todo_files = [f for f in ntuple_files if f not in done_set]
+        for i in range(0, len(todo_files), self.checkpoint_files):
+            chunk = todo_files[i:i + self.checkpoint_files]
+            h_chunk = self.fill_events([resolved[f] for f in chunk])
+            h = h_chunk if h is None else h + h_chunk
+            done_files = done_files + chunk
+
+            # write the checkpoint atomically, so that a preemption during the dump keeps the previous one
+            tmp = law.LocalFileTarget(checkpoint.abspath + ".tmp")
+            tmp.dump({"histogram": h, "files": done_files}, formatter="pickle")
+            os.replace(tmp.abspath, checkpoint.abspath)
+            self.publish_progress(100.0 * len(done_files) / len(ntuple_files))
+
+        if h is None:
+            h = self.fill_histogram([])
+
+        # save the histogram as task output and remove the checkpoint
+        self.output()["histogram"].dump(h, formatter="pickle")
+        checkpoint.remove(silent=True)
+
+    @property
+    def selection_index_content(self):
+        from trigger_sf.util.selection_index import cut_key
+
+        # the index and the masks are loaded once per task, the masks of a file are only read when its
+        # entries are first needed
+        if getattr(self, "_selection_index_content", None) is None:
+            index = self.input()["NTupleSelectionIndex"]["index"].load(formatter="json")
+            masks = self.input()["NTupleSelectionIndex"]["masks"].load(formatter="numpy")
+
+            # cuts of this task, which are contained in the index with the same expression
+            selections = [
+                op[2]
+                for op in self.recorded_operations
+                if op[0] == "Filter" and cut_key(op[2]) in index["cuts"]
+            ]
+            self._selection_index_content = (index, masks, selections)
+            self._indexed_file_entries = {}
+        return self._selection_index_content
+
+    def indexed_entries(self, ntuple_files):
+        from trigger_sf.util.selection_index import cut_key, selected_entries
+
+        index, masks, selections = self.selection_index_content
+        keys = [cut_key(selection) for selection in selections]
+
+        # combine the masks of each file once, files missing in the index are evaluated event by event
+        entries = {}
+        for uri in ntuple_files:
+            if uri not in self._indexed_file_entries:
+                file_index = index["files"].get(os.path.basename(uri))
+                if file_index is None:
+                    self.publish_message(f"{uri} is not contained in the selection index, not using it")
+                    return None, set()
+                file_masks = {key: masks[f"{file_index['id']}__{key}"] for key in keys}
+                self._indexed_file_entries[uri] = selected_entries(file_masks, file_index["n_entries"], keys)
+            entries[uri] = self._indexed_file_entries[uri]
+
+        return entries, set(selections)
+
+    def fill_events(self, ntuple_files):
+        from trigger_sf.util.distributed import SharedAccumulator, balanced_chunks, executor, fill_chunk
+        from trigger_sf.util.files import check_files
+        from trigger_sf.util.histograms import merge_histograms
+
+        if self.workers <= 0 or not ntuple_files:
+            return self.fill_histogram(ntuple_files)
+
+        # split the entries of all files into one chunk per worker, the numbers of entries are known from
+        # resolving the files
+        known_entries = getattr(self, "file_entries", {})
+        unknown = [uri for uri in ntuple_files if uri not in known_entries]
+        known_entries = dict(known_entries)
+        known_entries.update(check_files(unknown, self.analysis_inst.x.ntuple_tree, self.file_timeout))
+        unreadable = [uri for uri in unknown if uri not in known_entries]
+        if unreadable:
+            raise IOError(f"cannot read {', '.join(unreadable)}")
+        file_entries = {uri: known_entries[uri] for uri in ntuple_files}
+        chunks = balanced_chunks(file_entries, self.workers)
+        self.publish_message(
+            f"filling {sum(file_entries.values())} entries in {len(chunks)} chunks with {self.backend}",
+        )
+
+        # fill the chunks in the workers, which add their histograms to a shared buffer with the layout of
+        # the empty histogram, and merge the histograms of workers, which could not use the buffer
+        state = {
+            "processed_fraction": getattr(self, "processed_fraction", 1.0),
+            "event_sums": getattr(self, "event_sums", None),
+        }
+        accumulator = SharedAccumulator(self.fill_histogram([]))
+        try:
+            with executor(self.backend, self.workers, scheduler=self.dask_scheduler) as pool:
+                futures = [
+                    pool.submit(fill_chunk, self.__class__, self.param_kwargs, state, chunk, accumulator.spec)
+                    for chunk in chunks
+                ]
+                returned = [h for h in (future.result() for future in futures) if h is not None]
+            return merge_histograms([accumulator.histogram()] + returned)
+        finally:
+            accumulator.close()
+
+    def book_progress_metrics(self, events, planned_bytes, every=100000):
         import ROOT
-        from trigger_sf.util.rdf import category_selection, channel_selection, weight_production
-        from trigger_sf.util.histograms import create_hist
 
-        # get list of ntuple files
-        ntuple_files = [file.uri() for file in self.input()["NTupleFiles"]]
+        # the callback is invoked from the event loop every *every* entries, so it only sets a few gauges
+        registry = get_registry()
+        labels = {"task_family": self.task_family, "dataset": self.dataset, "category": self.category}
+        registry.set("tsf_planned_bytes", planned_bytes, help="estimated compressed bytes to read", **labels)
+        start = time.perf_counter()
 
-        # load ntuple files and create context
-        events = ROOT.RDataFrame("ntuple", ntuple_files)
-        ROOT.RDF.Experimental.AddProgressBar(events)
+        def update(count):
+            elapsed = max(time.perf_counter() - start, 1e-9)
+            registry.set("tsf_event_loop_entries", count, help="entries processed by the event loop", **labels)
+            registry.set(
+                "tsf_event_loop_entries_per_second",
+                count / elapsed,
+                help="throughput of the event loop",
+                **labels,
+            )
+            registry.set(
+                "tsf_event_loop_heartbeat_seconds",
+                time.time(),
+                help="unix time of the last progress update of the event loop",
+                **labels,
+            )
+            # ROOT only counts the bytes read by the whole process, so the gauge carries no task labels
+            registry.set(
+                "tsf_process_bytes_read",
+                ROOT.TFile.GetFileBytesRead(),
+                help="bytes read from files by this process",
+            )
+
+        progress = events.Count()
+        progress.OnPartialResult(every, update)
+        return progress
+
+    def fill_histogram(self, ntuple_files, entries=None):
+        # delayed imports, as packages are only needed for this task
+        import numpy as np
+        import ROOT
+        from trigger_sf.util.rdf import (
+            category_selection, channel_selection, open_events, record_graph, required_columns,
+            weight_production,
+        )
+        from trigger_sf.util.histograms import create_hist, fill_hist
+
+        # create context
         context = {
             "campaign": self.campaign_inst,
             "channel": self.channel_inst,
-            "category": self.category_inst, 
+            "category": self.category_inst,
             "dataset": self.dataset_inst,
             "process": self.process_inst,
-            "events": events,
+            "shifts": self.shift_insts,
+            "processed_fraction": getattr(self, "processed_fraction", 1.0),
+            "event_sums": getattr(self, "event_sums", None),
         }
 
+        # nothing to fill without files
+        if not ntuple_files:
+            shifts = ["nominal"] + list(self.shifts) if self.shift_insts else None
+            return create_hist(
+                self.config_inst,
+                self.variable_insts,
+                binnings=self.binnings,
+                n_replicas=self.n_replicas,
+                shifts=shifts,
+                **self.storage_kwargs,
+            )
+
+        # read only the entries passing the indexed cuts, which are then not evaluated again; if only a
+        # range of entries of each file is to be filled, the selected entries are restricted to it
+        if self.selection_index and not self.shift_insts:
+            indexed, context["indexed_selections"] = self.indexed_entries(ntuple_files)
+            if indexed is not None and entries is not None:
+                indexed = {uri: np.intersect1d(indexed[uri], entries[uri]) for uri in ntuple_files}
+            entries = indexed if indexed is not None else entries
+
+        # plan the branches to read from the selections, weights and variables
+        variable_expressions = [v.expression for v in self.variable_insts]
+        id_columns = ["run", "lumi", "event"] if self.n_replicas > 0 else []
+        columns = required_columns(record_graph(context), variable_expressions + id_columns)
+
+        # load ntuple files, only the planned branches are read
+        events, chain, planned_bytes = open_events(
+            "ntuple",
+            ntuple_files,
+            columns,
+            cache_size=self.tree_cache_size * 1024 ** 2,
+            entries=entries,
+            file_entries=getattr(self, "file_entries", None),
+        )
+        if entries is not None:
+            self.publish_message(f"reading {sum(len(e) for e in entries.values())} indexed entries")
+        self.publish_message(
+            f"reading {len(columns)} branches, estimated {planned_bytes / 1024 ** 2:.1f} MB compressed",
+        )
+        ROOT.RDF.Experimental.AddProgressBar(events)
+        context["events"] = events
+
+        # live metrics of the event loop, kept alive until the loop ran
+        progress = self.book_progress_metrics(events, planned_bytes) if metrics_enabled() else None
+
         # produce weights
         context = weight_production(context)
 
@@ -87,20 +730,79 @@ class CreateHistograms(DatasetTask):
         context = channel_selection(context)
         context = category_selection(context)
 
-        # get histogram data as numpy array
+        # systematic variations are booked as RDataFrame histograms and filled in the same event loop
         events = context["events"]
-        variable_expressions = [v.expression for v in self.variable_insts]
-        values = events.AsNumpy(columns=variable_expressions + ["total_weight"])
-        weight = values.pop("total_weight")
+        if self.shift_insts:
+            return self.create_shifted_hist(events, context["weight_column"])
+
+        # get histogram data as numpy array, event identifiers are needed to seed the bootstrap replicas
+        weight_columns = [context["weight_column"]] if context["weight_column"] else []
+        values = events.AsNumpy(columns=variable_expressions + id_columns + weight_columns)
+        weight = values.pop(weight_columns[0]) if weight_columns else None
 
         # create and fill the histogram
-        h = create_hist(self.config_inst, self.variable_insts)
+        h = create_hist(
+            self.config_inst,
+            self.variable_insts,
+            binnings=self.binnings,
+            n_replicas=self.n_replicas,
+            **self.storage_kwargs,
+        )
         args = [
             self.category_inst.name,
             self.process_inst.get_root_processes()[0].name,
         ]
-        args.extend([values[e] for e in variable_expressions])
-        h.fill(*args, weight=weight)
+        if self.n_replicas > 0:
+            # fill the nominal weights into replica 0 and the bootstrapped weights into all other replicas,
+            # one replica at a time to keep the memory linear in the number of events
+            from trigger_sf.util.bootstrap import event_seeds, replica_weights
+            seeds = event_seeds(*[values.pop(c) for c in id_columns])
+            args.extend([values[e] for e in variable_expressions])
+            fill_hist(h, *args, 0, weight=weight)
+            for replica in range(1, self.n_replicas + 1):
+                replica_weight = replica_weights(seeds, replica)
+                if weight is not None:
+                    replica_weight *= weight
+                fill_hist(h, *args, replica, weight=replica_weight)
+        else:
+            args.extend([values[e] for e in variable_expressions])
+            fill_hist(h, *args, weight=weight)
+
+        return h
+
+    def create_shifted_hist(self, events, weight_column):
+        import ROOT
+        from trigger_sf.util.histograms import create_hist, fill_root_histogram
+        from trigger_sf.util.rdf import book_histogram
+
+        # book the nominal histogram and all its variations
+        h_ptr = book_histogram(
+            events,
+            list(self.variable_insts.values()),
+            weight=weight_column,
+            binnings=self.binnings,
+        )
+        variations = ROOT.RDF.Experimental.VariationsFor(h_ptr)
+        keys = [str(key) for key in variations.GetKeys()]
+
+        # fill all shifts into the shift axis, shifts that do not apply to this dataset (e.g. MC-only
+        # variations for data) are filled with the nominal histogram; the ROOT histograms are copied
+        # including their errors, which requires the weight storage
+        storage_kwargs = dict(self.storage_kwargs)
+        if storage_kwargs["storage"] != "sparse":
+            storage_kwargs["storage"] = "weight"
+        h = create_hist(
+            self.config_inst,
+            self.variable_insts,
+            binnings=self.binnings,
+            shifts=["nominal"] + list(self.shifts),
+            **storage_kwargs,
+        )
+        process = self.process_inst.get_root_processes()[0].name
+        for shift_inst in [self.config_inst.get_shift("nominal")] + self.shift_insts:
+            key = "nominal" if shift_inst.is_nominal else f"{shift_inst.source}:{shift_inst.direction}"
+            if key not in keys:
+                key = "nominal"
+            fill_root_histogram(h, variations[key], self.category_inst.name, process, shift_inst.name)
 
-        # save the histogram as task output
-        self.output().dump(h, formatter="pickle")
+        return h
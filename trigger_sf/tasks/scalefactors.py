@@ -4,10 +4,13 @@ import order as od
 
 from trigger_sf.tasks.base import EfficiencyTask
 from trigger_sf.tasks.efficiencies import CalculateEfficiencies
+from trigger_sf.util.metrics import get_registry
 
 
 class CalculateScaleFactors(EfficiencyTask):
 
+    contrib_packages = ("numpy", )
+
     def requires(self):
         return {
             "CreateEfficiencies_data": CalculateEfficiencies.req(self, processes=[p.name for p in self.data_process_insts]),
@@ -18,26 +21,68 @@ class CalculateScaleFactors(EfficiencyTask):
         return self.local_target("scalefactors.npz")
 
     def run(self):
+        from trigger_sf.util.histograms import calculate_scale_factors
+
         # load efficiency dictionaries
         eff_dict_data = self.input()["CreateEfficiencies_data"].load(formatter="numpy")
         eff_dict_mc = self.input()["CreateEfficiencies_mc"].load(formatter="numpy")
 
         # perform division and error estimation
-        sf_nominal = eff_dict_data["nominal"] / eff_dict_mc["nominal"]
-        sf_up = eff_dict_data["up"] / eff_dict_mc["down"]
-        sf_down = eff_dict_data["down"] / eff_dict_mc["up"]
+        scale_factors = calculate_scale_factors(eff_dict_data, eff_dict_mc, shifts=self.shifts)
 
         # save scale factors
-        self.output().dump(
-            nominal=sf_nominal,
-            up=sf_up,
-            down=sf_down,
-            formatter="numpy",
+        self.output().dump(**scale_factors, formatter="numpy")
+
+
+class ExportScaleFactors(EfficiencyTask):
+
+    contrib_packages = ("numpy", )
+
+    def requires(self):
+        return {
+            "CalculateScaleFactors": CalculateScaleFactors.req(self),
+        }
+
+    def output(self):
+        return {
+            "json": self.local_target("scalefactors.json"),
+            "table": self.local_target("scalefactors.lut"),
+        }
+
+    def run(self):
+        from trigger_sf.util.lookup import correctionlib_json, write_lookup_table
+
+        # load scale factors dictionary
+        scalefactors = self.input()["CalculateScaleFactors"].load(formatter="numpy")
+        scalefactors = {variation: scalefactors[variation] for variation in self.variations}
+
+        # variable names and bin edges
+        variables = [v.name for v in self.variable_insts]
+        edges = [list(v.bin_edges) for v in self.variable_insts]
+
+        # correctionlib-style description of the scale factors
+        name = f"trigger_sf__{self.channel}__{self.sig_ref_category}"
+        self.output()["json"].dump(
+            correctionlib_json(
+                name,
+                variables,
+                edges,
+                scalefactors,
+                description=f"trigger scale factors of {self.sig_ref_category} w.r.t. {self.ref_category}",
+            ),
+            formatter="json",
         )
 
+        # compact binary lookup table
+        output = self.output()["table"]
+        output.parent.touch()
+        write_lookup_table(output.abspath, variables, edges, scalefactors)
+
 
 class PlotScaleFactors(EfficiencyTask):
 
+    contrib_packages = ("matplotlib", "numpy")
+
     extensions = law.CSVParameter(
         description="extensions of the image file to be produced; default: 'png,pdf'",
         default=["png", "pdf"]
@@ -55,16 +100,11 @@ class PlotScaleFactors(EfficiencyTask):
             for extension in self.extensions
         }
 
-    def run(self):
+    def create_figures(self, scalefactors):
         # delayed imports, as packages are only needed for this task
-        import matplotlib as mpl
-        import mplhep
         import numpy as np
         from trigger_sf.util.plotting import plot_2d_colormesh
 
-        # load scale factors dictionary
-        scalefactors = self.input()["CalculateScaleFactors"].load(formatter="numpy")
-
         # variable bin edges and labels
         variable_insts = list(self.variable_insts.values())
         x_bin_edges = np.array(variable_insts[0].bin_edges)
@@ -84,30 +124,52 @@ class PlotScaleFactors(EfficiencyTask):
 
         # keyword arguments for cms label command
         mplhep_label_kwargs = {
-            "lumi": self.campaign_inst.x.lumi,
+            "lumi": self.lumi,
             "fontsize": 22,
         }
 
-        # produce the efficiency plot
+        # produce the plot of each variation, must be called within the plot style context
+        for variation in self.variations:
+            # colorbar label
+            z_label = f"$\\epsilon_{{data}}/\\epsilon_{{MC}}$ ({variation})"
+
+            # create the plot
+            fig, ax = plot_2d_colormesh(
+                x_bin_edges,
+                y_bin_edges,
+                scalefactors[variation],
+                x_label,
+                y_label,
+                z_label,
+                pcolormesh_kwargs=pcolormesh_kwargs,
+                colorbar_kwargs=colorbar_kwargs,
+                mplhep_label_kwargs=mplhep_label_kwargs,
+            )
+
+            yield variation, fig
+
+    def run(self):
+        # delayed imports, as packages are only needed for this task
+        import matplotlib as mpl
+        import matplotlib.pyplot as plt
+        import mplhep
+
+        # load scale factors dictionary
+        scalefactors = self.input()["CalculateScaleFactors"].load(formatter="numpy")
+
+        # produce and save the plots
+        registry = get_registry()
         with mpl.style.context(mplhep.style.CMS):
-            for variation in self.variations:
-                # colorbar label
-                z_label = f"$\\epsilon_{{data}}/\\epsilon_{{MC}}$ ({variation})"
-
-                # create the plot
-                fig, ax = plot_2d_colormesh(
-                    x_bin_edges,
-                    y_bin_edges,
-                    scalefactors[variation],
-                    x_label,
-                    y_label,
-                    z_label,
-                    pcolormesh_kwargs=pcolormesh_kwargs,
-                    colorbar_kwargs=colorbar_kwargs,
-                    mplhep_label_kwargs=mplhep_label_kwargs,
+            for variation, fig in self.create_figures(scalefactors):
+                figure_timer = registry.timer(
+                    "tsf_figure_save_seconds",
+                    help="time to save a figure in all formats",
+                    task_family=self.task_family,
                 )
-
-                for extension in self.extensions:
-                    self.output()[(variation, extension)].dump(fig, formatter="mpl")
+                with figure_timer:
+                    for extension in self.extensions:
+                        self.output()[(variation, extension)].dump(fig, formatter="mpl")
+                registry.inc("tsf_figures_total", help="number of saved figures", task_family=self.task_family)
+                plt.close(fig)
 
 
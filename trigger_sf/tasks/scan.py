@@ -0,0 +1,303 @@
+import law
+import luigi
+import order as od
+import os
+
+from trigger_sf.tasks.base import ConfigTask, DatasetTask
+from trigger_sf.tasks.histograms import NormalizationMixin, NTupleFiles, NTupleMetadata
+from trigger_sf.util.manifest import fingerprint
+from trigger_sf.util.scan import load_scan, scan_file_hash, scan_points
+
+
+class ScanTask(ConfigTask):
+
+    contrib_packages = ("numpy", )
+
+    scan_file = luigi.Parameter(
+        description="path to the YAML file, which defines the grid of variables, binnings and categories to scan",
+    )
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        # load the scan definition and expand it into points
+        self.scan = load_scan(os.path.expandvars(self.scan_file))
+        self.scan_points = scan_points(self.scan)
+
+    @property
+    def scan_name(self):
+        return os.path.splitext(os.path.basename(self.scan_file))[0]
+
+    @property
+    def scan_categories(self):
+        return sorted(set(
+            category
+            for point in self.scan_points
+            for category in (point["ref_category"], point["sig_ref_category"])
+        ))
+
+    def config_fingerprint(self):
+        return scan_file_hash(os.path.expandvars(self.scan_file))
+
+    @property
+    def store_parts(self):
+        return super().store_parts + (self.scan_name, )
+
+
+class CreateScanHistograms(NormalizationMixin, ScanTask, DatasetTask):
+
+    # histograms are fully determined by the configuration hash and can be shared across versions
+    version_independent = True
+
+    tree_cache_size = luigi.IntParameter(
+        description="size of the TTree cache for the planned branches in MB; default: 100",
+        default=100,
+        significant=False,
+    )
+
+    @property
+    def selection_is_empty(self):
+        from trigger_sf.util.rdf import record_graph, selection_is_empty
+
+        # the scan histograms are only known to be empty if the selections of all categories reject all events
+        context = {
+            "campaign": self.campaign_inst,
+            "channel": self.channel_inst,
+            "dataset": self.dataset_inst,
+            "process": self.process_inst,
+        }
+        return all(
+            selection_is_empty(record_graph(dict(context, category=self.config_inst.get_category(category))))
+            for category in self.scan_categories
+        )
+
+    def requires(self):
+        # no files are needed if the selections are known to reject all events
+        if self.selection_is_empty:
+            return {}
+
+        return {
+            "NTupleFiles": NTupleFiles.req(self),
+            "NTupleMetadata": NTupleMetadata.req(self),
+        }
+
+    def config_fingerprint(self):
+        from trigger_sf.tasks.histograms import CreateHistograms
+
+        # the scan histograms depend on the scan definition and on the selections of each category
+        return fingerprint(
+            super().config_fingerprint(),
+            [
+                CreateHistograms.req(self, category=category, variables=list(self.config_inst.variables.names()))
+                .config_fingerprint()
+                for category in self.scan_categories
+            ],
+        )
+
+    def output(self):
+        return self.local_target("histograms.pickle")
+
+    def run(self):
+        # delayed imports, as packages are only needed for this task
+        import ROOT
+        from trigger_sf.util.rdf import (
+            category_selection, channel_selection, open_events, record_graph, required_columns,
+            weight_production,
+        )
+        from trigger_sf.util.histograms import create_hist
+
+        # statically empty selections result in empty histograms without reading any file
+        if self.selection_is_empty:
+            self.publish_message("selections reject all events, writing empty histograms")
+            self.output().dump(
+                {
+                    point["name"]: create_hist(
+                        self.config_inst,
+                        [self.config_inst.get_variable(v) for v in point["variables"]],
+                        binnings=point["binnings"],
+                    )
+                    for point in self.scan_points
+                },
+                formatter="pickle",
+            )
+            return
+
+        # get list of ntuple files
+        ntuple_targets = self.input()["NTupleFiles"]
+        ntuple_files = [file.uri() for file in ntuple_targets]
+
+        # the normalization is determined in the same way as for CreateHistograms
+        self.load_normalization(ntuple_targets, ntuple_files)
+
+        # create context
+        context = {
+            "campaign": self.campaign_inst,
+            "channel": self.channel_inst,
+            "dataset": self.dataset_inst,
+            "process": self.process_inst,
+            "processed_fraction": self.processed_fraction,
+            "event_sums": self.event_sums,
+        }
+
+        # plan the branches to read from the selections of all categories, the weights and the variables
+        expressions = [
+            self.config_inst.get_variable(v).expression
+            for point in self.scan_points
+            for v in point["variables"]
+        ]
+        columns = sorted(set().union(*[
+            required_columns(
+                record_graph(dict(context, category=self.config_inst.get_category(category))),
+                expressions,
+            )
+            for category in self.scan_categories
+        ]))
+
+        # load ntuple files, only the planned branches are read
+        events, chain, planned_bytes = open_events(
+            "ntuple",
+            ntuple_files,
+            columns,
+            cache_size=self.tree_cache_size * 1024 ** 2,
+        )
+        self.publish_message(
+            f"reading {len(columns)} branches, estimated {planned_bytes / 1024 ** 2:.1f} MB compressed",
+        )
+        ROOT.RDF.Experimental.AddProgressBar(events)
+        context["events"] = events
+
+        # weights and the channel selection are shared by all categories
+        context = weight_production(context)
+        context = channel_selection(context)
+
+        # book the columns needed by all points of each category, nothing is executed yet
+        booked = {}
+        for category in self.scan_categories:
+            category_inst = self.config_inst.get_category(category)
+            category_context = category_selection(dict(context, category=category_inst))
+            expressions = sorted(set(
+                self.config_inst.get_variable(v).expression
+                for point in self.scan_points
+                if category in (point["ref_category"], point["sig_ref_category"])
+                for v in point["variables"]
+            ))
+            booked[category] = category_context["events"].AsNumpy(
+                columns=expressions + ([context["weight_column"]] if context["weight_column"] else []),
+                lazy=True,
+            )
+
+        # fill the histograms of all points, the first access triggers one event loop for all categories
+        process = self.process_inst.get_root_processes()[0].name
+        histograms = {}
+        for point in self.scan_points:
+            variable_insts = od.UniqueObjectIndex(
+                od.Variable,
+                [self.config_inst.get_variable(v) for v in point["variables"]],
+            )
+            h = create_hist(self.config_inst, variable_insts, binnings=point["binnings"])
+            for category in (point["ref_category"], point["sig_ref_category"]):
+                values = booked[category].GetValue()
+                args = [category, process]
+                args.extend([values[v.expression] for v in variable_insts])
+                h.fill(*args, weight=values[context["weight_column"]] if context["weight_column"] else None)
+            histograms[point["name"]] = h
+
+        # save the histograms of all points as task output
+        self.output().dump(histograms, formatter="pickle")
+
+
+class CalculateScanEfficiencies(ScanTask):
+
+    processes = law.CSVParameter(
+        description="comma-separated list of processes; default: processes of the scan file",
+        default=(),
+    )
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        # get process instances and sort process names
+        self.processes = tuple(sorted(list(self.processes or self.scan["processes"])))
+        self.process_insts = od.UniqueObjectIndex(
+            od.Process,
+            [self.config_inst.get_process(p) for p in self.processes],
+        )
+
+    @property
+    def store_parts(self):
+        return super().store_parts + ("__".join(self.processes), )
+
+    def requires(self):
+        datasets = [
+            d.name
+            for d in self.config_inst.datasets.values()
+            if any([list(d.processes.values())[0].has_parent_process(p) for p in self.process_insts])
+        ]
+        return [
+            CreateScanHistograms.req(self, channel=self.scan["channel"], dataset=dataset)
+            for dataset in datasets
+        ]
+
+    def output(self):
+        return {
+            point["name"]: self.local_target(point["name"], "efficiencies.npz")
+            for point in self.scan_points
+        }
+
+    def run(self):
+        from trigger_sf.util.histograms import calculate_efficiencies
+
+        # sum the histograms of each point over all datasets
+        histograms = {}
+        for input in self.input():
+            for name, h in input.load(formatter="pickle").items():
+                if name in histograms:
+                    histograms[name] += h
+                else:
+                    histograms[name] = h
+
+        # calculate and save the efficiencies of each point
+        processes = [p.name for p in self.process_insts]
+        outputs = self.output()
+        for point in self.scan_points:
+            data = calculate_efficiencies(
+                histograms[point["name"]],
+                point["ref_category"],
+                point["sig_ref_category"],
+                processes,
+            )
+            outputs[point["name"]].dump(**data, formatter="numpy")
+
+
+class CalculateScanScaleFactors(ScanTask):
+
+    def requires(self):
+        processes = [self.config_inst.get_process(p) for p in self.scan["processes"]]
+        return {
+            "CalculateScanEfficiencies_data": CalculateScanEfficiencies.req(
+                self,
+                processes=[p.name for p in processes if p.is_data],
+            ),
+            "CalculateScanEfficiencies_mc": CalculateScanEfficiencies.req(
+                self,
+                processes=[p.name for p in processes if p.is_mc],
+            ),
+        }
+
+    def output(self):
+        return {
+            point["name"]: self.local_target(point["name"], "scalefactors.npz")
+            for point in self.scan_points
+        }
+
+    def run(self):
+        from trigger_sf.util.histograms import calculate_scale_factors
+
+        # calculate and save the scale factors of each point
+        inputs = self.input()
+        outputs = self.output()
+        for point in self.scan_points:
+            eff_dict_data = inputs["CalculateScanEfficiencies_data"][point["name"]].load(formatter="numpy")
+            eff_dict_mc = inputs["CalculateScanEfficiencies_mc"][point["name"]].load(formatter="numpy")
+            scale_factors = calculate_scale_factors(eff_dict_data, eff_dict_mc)
+            outputs[point["name"]].dump(**scale_factors, formatter="numpy")
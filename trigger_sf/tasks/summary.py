@@ -0,0 +1,101 @@
+import luigi
+
+from trigger_sf.tasks.base import EfficiencyTask
+from trigger_sf.tasks.efficiencies import CalculateEfficiencies, PlotEfficiencies
+from trigger_sf.tasks.scalefactors import CalculateScaleFactors, PlotScaleFactors
+from trigger_sf.util.metrics import get_registry
+
+
+class PlotSummary(EfficiencyTask):
+
+    contrib_packages = ("numpy", )
+
+    n_columns = luigi.IntParameter(
+        description="number of columns of the tiled image; default: 3",
+        default=3,
+        significant=False,
+    )
+
+    def requires(self):
+        return {
+            "CalculateEfficiencies_data": CalculateEfficiencies.req(self, processes=[p.name for p in self.data_process_insts]),
+            "CalculateEfficiencies_mc": CalculateEfficiencies.req(self, processes=[p.name for p in self.mc_process_insts]),
+            "CalculateScaleFactors": CalculateScaleFactors.req(self),
+        }
+
+    def output(self):
+        return {
+            "pdf": self.local_target("summary.pdf"),
+            "png": self.local_target("summary.png"),
+            "hash": self.local_target("summary.hash"),
+        }
+
+    def input_hash(self):
+        import hashlib
+
+        # hash of the content of all input files, independent of when they were written
+        h = hashlib.sha1()
+        for key, target in sorted(self.input().items()):
+            h.update(key.encode("utf-8"))
+            with open(target.abspath, mode="rb") as f:
+                h.update(f.read())
+        return h.hexdigest()
+
+    def run(self):
+        # delayed imports, as packages are only needed for this task
+        import matplotlib as mpl
+        import matplotlib.pyplot as plt
+        import mplhep
+        from matplotlib.backends.backend_pdf import PdfPages
+        from trigger_sf.util.plotting import figure_to_rgba, tile_images
+
+        # skip rendering if the inputs did not change since the last rendering
+        outputs = self.output()
+        input_hash = self.input_hash()
+        if (
+            outputs["hash"].exists() and outputs["pdf"].exists() and outputs["png"].exists()
+            and outputs["hash"].load(formatter="text").strip() == input_hash
+        ):
+            self.publish_message("inputs unchanged, skip rendering")
+            outputs["hash"].touch()
+            return
+
+        # plotting tasks of each process group and the scale factors, which create the figures
+        inputs = self.input()
+        plot_tasks = [
+            (
+                PlotEfficiencies.req(self, processes=[p.name for p in self.mc_process_insts]),
+                inputs["CalculateEfficiencies_mc"],
+            ),
+            (
+                PlotEfficiencies.req(self, processes=[p.name for p in self.data_process_insts]),
+                inputs["CalculateEfficiencies_data"],
+            ),
+            (
+                PlotScaleFactors.req(self),
+                inputs["CalculateScaleFactors"],
+            ),
+        ]
+
+        # render each figure once within a single style context, write it as a page of the PDF and keep the
+        # pixels for the tiled image
+        images = []
+        registry = get_registry()
+        outputs["pdf"].parent.touch()
+        with mpl.style.context(mplhep.style.CMS), PdfPages(outputs["pdf"].abspath) as pdf:
+            for task, input in plot_tasks:
+                for variation, fig in task.create_figures(input.load(formatter="numpy")):
+                    figure_timer = registry.timer(
+                        "tsf_figure_save_seconds",
+                        help="time to save a figure in all formats",
+                        task_family=self.task_family,
+                    )
+                    with figure_timer:
+                        images.append(figure_to_rgba(fig))
+                        pdf.savefig(fig)
+                    registry.inc("tsf_figures_total", help="number of saved figures", task_family=self.task_family)
+                    plt.close(fig)
+
+        # save the tiled image and the hash of the rendered inputs
+        plt.imsave(outputs["png"].abspath, tile_images(images, n_columns=self.n_columns))
+        outputs["hash"].dump(input_hash, formatter="text")
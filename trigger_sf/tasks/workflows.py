@@ -1,8 +1,10 @@
 import law
+import luigi
 
 from trigger_sf.tasks.base import EfficiencyTask
 from trigger_sf.tasks.efficiencies import PlotEfficiencies
-from trigger_sf.tasks.scalefactors import PlotScaleFactors
+from trigger_sf.tasks.scalefactors import ExportScaleFactors, PlotScaleFactors
+from trigger_sf.tasks.summary import PlotSummary
 
 
 class HadronicRecoilTriggerWorkflow(EfficiencyTask, law.WrapperTask):
@@ -12,6 +14,12 @@ class HadronicRecoilTriggerWorkflow(EfficiencyTask, law.WrapperTask):
     ref_category = "mm_incl"
     sig_ref_category = "sig_pfht_trigger"
 
+    combined = luigi.BoolParameter(
+        description="produce a single multi-page PDF and a tiled PNG with all plots instead of one file per "
+        "plot; default: False",
+        default=False,
+    )
+
     def requires(self):
         # define parameters, which all tasks have in common
         common_params = {
@@ -21,10 +29,18 @@ class HadronicRecoilTriggerWorkflow(EfficiencyTask, law.WrapperTask):
             "sig_ref_category": self.sig_ref_category,
         }
 
+        # combined efficiency and scale factor plots for the hadronic recoil trigger
+        if self.combined:
+            return [
+                PlotSummary.req(self, **common_params, processes=self.processes),
+                ExportScaleFactors.req(self, **common_params, processes=self.processes),
+            ]
+
         # efficiency and scale factor plots for the hadronic recoil trigger
         reqs = [
             PlotEfficiencies.req(self, **common_params, processes=list(self.mc_process_insts.names())),
             PlotEfficiencies.req(self, **common_params, processes=list(self.data_process_insts.names())),
             PlotScaleFactors.req(self, **common_params, processes=self.processes),
+            ExportScaleFactors.req(self, **common_params, processes=self.processes),
         ]
         return reqs
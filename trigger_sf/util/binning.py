@@ -0,0 +1,114 @@
+"""
+Search for merged bin boundaries of efficiency maps on top of fine-binned histograms. For a merged bin, the
+efficiency uncertainty is estimated with the half width of the Clopper-Pearson interval using the effective
+number of entries of the reference category, which is used for the efficiency maps as well. A merged bin is
+accepted if it has at least *min_entries* effective entries and a relative efficiency uncertainty of at most
+*max_rel_unc*, which has to hold in all bins of the other variables. Bins with a vanishing efficiency have no
+finite relative uncertainty and are never accepted.
+"""
+
+from __future__ import annotations
+from typing import List, Sequence
+
+import hist.intervals
+import numpy as np
+
+
+def _feasible_segments(sum_ref, sum_ref_w2, sum_sig, min_entries, max_rel_unc):
+    # cumulative sums along the first axis allow to evaluate all segments [i, j) at once
+    def cumulative(a):
+        return np.concatenate([np.zeros((1, ) + a.shape[1:]), np.cumsum(a, axis=0)], axis=0)
+
+    c_ref, c_ref_w2, c_sig = cumulative(sum_ref), cumulative(sum_ref_w2), cumulative(sum_sig)
+    ref = c_ref[np.newaxis, :] - c_ref[:, np.newaxis]
+    ref_w2 = c_ref_w2[np.newaxis, :] - c_ref_w2[:, np.newaxis]
+    sig = c_sig[np.newaxis, :] - c_sig[:, np.newaxis]
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        n_eff = np.where(ref_w2 > 0, ref ** 2 / ref_w2, 0.0)
+        eff = np.clip(np.where(ref > 0, sig / ref, 0.0), 0.0, 1.0)
+        interval = hist.intervals.clopper_pearson_interval(eff * n_eff, n_eff, coverage=0.68)
+        rel_unc = np.where(eff > 0, 0.5 * (interval[1] - interval[0]) / eff, np.inf)
+        rel_unc = np.where(np.isnan(rel_unc), np.inf, rel_unc)
+
+    # segments are feasible if the criteria hold in all bins of the other variables
+    ok = (n_eff >= min_entries) & (rel_unc <= max_rel_unc)
+    return ok.reshape(ok.shape[:2] + (-1, )).all(axis=-1)
+
+
+def optimize_edges(
+    fine_edges: Sequence[float],
+    sum_ref: np.ndarray,
+    sum_ref_w2: np.ndarray,
+    sum_sig: np.ndarray,
+    min_entries: float = 20.0,
+    max_rel_unc: float = 0.1,
+) -> List[float]:
+    """
+    Merge the fine bins along the first axis of the given arrays into the largest number of bins, which all
+    fulfill the criteria, using dynamic programming over all segments. If no such partition exists, the
+    bins at the upper end, which cannot fulfill the criteria, are merged into the last feasible bin.
+    """
+    n = len(fine_edges) - 1
+    feasible = _feasible_segments(sum_ref, sum_ref_w2, sum_sig, min_entries, max_rel_unc)
+
+    # best[j]: largest number of feasible bins partitioning the first j fine bins
+    best = np.full(n + 1, -1, dtype=int)
+    previous = np.zeros(n + 1, dtype=int)
+    best[0] = 0
+    for j in range(1, n + 1):
+        candidates = np.where(feasible[:j, j] & (best[:j] >= 0), best[:j] + 1, -1)
+        i = int(np.argmax(candidates))
+        if candidates[i] >= 0:
+            best[j], previous[j] = candidates[i], i
+
+    # trace back the boundaries from the last fine boundary, which can be reached with feasible bins
+    end = n if best[n] >= 0 else int(np.max(np.nonzero(best >= 0)[0]))
+    boundaries = [0]
+    j = end
+    while j > 0:
+        boundaries.insert(1, j)
+        j = previous[j]
+
+    # remaining fine bins at the upper end are merged into the last bin
+    if end < n:
+        boundaries = boundaries[:-1] + [n] if len(boundaries) > 1 else [0, n]
+
+    return [float(fine_edges[b]) for b in boundaries]
+
+
+def optimize_binning(
+    fine_edges: Sequence[Sequence[float]],
+    sum_ref: np.ndarray,
+    sum_ref_w2: np.ndarray,
+    sum_sig: np.ndarray,
+    min_entries: float = 20.0,
+    max_rel_unc: float = 0.1,
+    iterations: int = 3,
+) -> List[List[float]]:
+    """
+    Optimize the binning of all axes of N-dimensional fine-binned sums. Each axis is optimized in turn, with
+    the other axes merged according to their current binning, which starts with a single bin.
+    """
+    fine_edges = [np.asarray(edges, dtype=np.float64) for edges in fine_edges]
+    edges = [[e[0], e[-1]] for e in fine_edges]
+
+    def merge(a, axis, new_edges):
+        # sum the fine bins of one axis into the bins given by a subset of the fine edges
+        indices = np.searchsorted(fine_edges[axis], new_edges)
+        return np.add.reduceat(a, indices[:-1], axis=axis)
+
+    for _ in range(iterations):
+        previous = [list(e) for e in edges]
+        for axis in range(len(fine_edges)):
+            arrays = []
+            for a in (sum_ref, sum_ref_w2, sum_sig):
+                for other in range(len(fine_edges)):
+                    if other != axis:
+                        a = merge(a, other, edges[other])
+                arrays.append(np.moveaxis(a, axis, 0))
+            edges[axis] = optimize_edges(fine_edges[axis], *arrays, min_entries=min_entries, max_rel_unc=max_rel_unc)
+        if edges == previous:
+            break
+
+    return [[float(e) for e in _edges] for _edges in edges]
@@ -0,0 +1,48 @@
+import math
+
+import numpy as np
+
+
+# cumulative distribution function of a Poisson distribution with mean 1, truncated at k = 20
+POISSON_1_CDF = np.cumsum([math.exp(-1) / math.factorial(k) for k in range(21)])
+
+
+def _mix(x):
+    # splitmix64 finalizer, arithmetic wraps around on 64 bit unsigned integers
+    with np.errstate(over="ignore"):
+        x = (x ^ (x >> np.uint64(30))) * np.uint64(0xbf58476d1ce4e5b9)
+        x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94d049bb133111eb)
+        return x ^ (x >> np.uint64(31))
+
+
+def event_seeds(run, lumi, event):
+    # deterministic per-event seed, independent of the order in which events are processed
+    seed = _mix(np.asarray(run, dtype=np.uint64))
+    seed = _mix(seed ^ np.asarray(lumi, dtype=np.uint64))
+    seed = _mix(seed ^ np.asarray(event, dtype=np.uint64))
+    return seed
+
+
+def replica_weights(seeds, replica):
+    """
+    Poisson(1) bootstrap weights of the events with *seeds* (see :py:func:`event_seeds`) in replica number
+    *replica*, starting at 1. Replicas are generated one at a time, so that the memory stays linear in the
+    number of events.
+    """
+    with np.errstate(over="ignore"):
+        key = _mix(np.uint64(replica) * np.uint64(0x9e3779b97f4a7c15))
+
+    # uniform numbers in [0, 1) from the upper 53 bits of the mixed seeds
+    u = (_mix(np.asarray(seeds, dtype=np.uint64) ^ key) >> np.uint64(11)) * (2.0 ** -53)
+
+    # inverse transform sampling of the Poisson distribution
+    return np.searchsorted(POISSON_1_CDF, u, side="right").astype(np.float64)
+
+
+def poisson_replica_weights(run, lumi, event, n_replicas):
+    """
+    Poisson(1) bootstrap weights with shape (n_events, n_replicas). The same event obtains the same
+    weights in every job and every category, which preserves the correlations between categories.
+    """
+    seeds = event_seeds(run, lumi, event)
+    return np.stack([replica_weights(seeds, replica) for replica in range(1, n_replicas + 1)], axis=-1)
@@ -0,0 +1,168 @@
+"""
+Distributed filling of histograms. The entries of all files are split into balanced chunks, each chunk
+is filled by a worker, which re-creates the task from its parameters and runs the same weight production
+and selections on its entries, and the partial histograms are summed. Workers are either local processes
+or the workers of a Dask cluster, which can be a LocalCluster for tests on a single machine or an existing
+scheduler reached by its address.
+
+Workers on the same machine add their partial histograms in place into one shared memory buffer with the
+layout of the flow view of the histogram, so that no partial histogram has to be serialized and the
+memory of the merge does not grow with the number of workers. Workers, which cannot attach to the
+buffer (e.g. on other nodes of a Dask cluster) or whose histogram layout differs (e.g. for growing
+axes), return their histograms instead, which are merged as usual.
+"""
+
+from __future__ import annotations
+from contextlib import contextmanager
+import fcntl
+from multiprocessing import resource_tracker, shared_memory
+import os
+import tempfile
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+
+def balanced_chunks(file_entries: Dict[str, int], n_chunks: int) -> List[Dict[str, Tuple[int, int]]]:
+    """
+    Split the entries of all files, concatenated in the given order, into *n_chunks* chunks with equal
+    numbers of entries (up to one). Each chunk maps files to the range of entries [start, stop) to read.
+    """
+    offsets = np.cumsum([0] + list(file_entries.values()))
+    bounds = np.linspace(0, offsets[-1], n_chunks + 1).round().astype(np.int64)
+
+    chunks = []
+    for begin, end in zip(bounds[:-1], bounds[1:]):
+        chunk = {}
+        for uri, offset, n in zip(file_entries.keys(), offsets[:-1], file_entries.values()):
+            start, stop = max(begin - offset, 0), min(end - offset, n)
+            if start < stop:
+                chunk[uri] = (int(start), int(stop))
+        if chunk:
+            chunks.append(chunk)
+    return chunks
+
+
+class SharedAccumulator(object):
+    """
+    Shared memory buffer with the layout of the flow view of the *template* histogram, into which the
+    histograms of several processes are added in place. Access is serialized with a lock file. Only the
+    :py:attr:`spec` has to be passed to the workers.
+    """
+
+    def __init__(self, template):
+        view = np.asarray(template.view(flow=True))
+        self.template = template
+        self.shm = shared_memory.SharedMemory(create=True, size=max(view.nbytes, 1))
+        self.array = np.ndarray(view.shape, dtype=view.dtype, buffer=self.shm.buf)
+        self.array[...] = 0
+        fd, self.lock_path = tempfile.mkstemp(prefix="tsf_shm_", suffix=".lock")
+        os.close(fd)
+
+    @property
+    def spec(self):
+        return {
+            "name": self.shm.name,
+            "shape": self.array.shape,
+            "dtype": self.array.dtype,
+            "lock_path": self.lock_path,
+        }
+
+    def histogram(self):
+        # copy the accumulated bins into a new histogram, boost-histogram does not adopt external buffers
+        h = self.template.copy()
+        h.view(flow=True)[...] = self.array
+        return h
+
+    def close(self):
+        del self.array
+        self.shm.close()
+        self.shm.unlink()
+        os.remove(self.lock_path)
+
+
+def _attach(name: str) -> shared_memory.SharedMemory:
+    # the buffer is owned by the accumulator, so attaching must not register it with the resource tracker,
+    # which would unlink it when this process exits; python < 3.13 has no argument to disable the tracking
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        register = resource_tracker.register
+        resource_tracker.register = lambda *args, **kwargs: None
+        try:
+            return shared_memory.SharedMemory(name=name)
+        finally:
+            resource_tracker.register = register
+
+
+def add_to_shared(spec: Dict, h) -> bool:
+    """
+    Add the flow view of histogram *h* in place to the shared buffer described by *spec*. Returns False if
+    the buffer is not reachable from this process or its layout does not match the histogram.
+    """
+    view = np.asarray(h.view(flow=True))
+    if view.shape != tuple(spec["shape"]) or view.dtype != spec["dtype"]:
+        return False
+    try:
+        shm = _attach(spec["name"])
+    except FileNotFoundError:
+        return False
+
+    try:
+        array = np.ndarray(view.shape, dtype=view.dtype, buffer=shm.buf)
+        with open(spec["lock_path"], mode="a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            if view.dtype.names:
+                for field in view.dtype.names:
+                    array[field] += view[field]
+            else:
+                array += view
+        del array
+    finally:
+        shm.close()
+    return True
+
+
+def fill_chunk(task_cls, param_kwargs: Dict, state: Dict, chunk: Dict[str, Tuple[int, int]], shared=None):
+    # re-create the task in the worker, restore the state determined by the scheduling process and fill
+    # the entries of the chunk
+    task = task_cls(**param_kwargs)
+    for attr, value in state.items():
+        setattr(task, attr, value)
+    entries = {uri: np.arange(start, stop, dtype=np.int64) for uri, (start, stop) in chunk.items()}
+    h = task.fill_histogram(list(chunk.keys()), entries=entries)
+
+    # add the histogram to the shared buffer if possible, otherwise return it
+    if shared is not None and add_to_shared(shared, h):
+        return None
+    return h
+
+
+@contextmanager
+def executor(backend: str, n_workers: int, scheduler: Optional[str] = None):
+    """
+    Context providing an object with a ``submit(fn, *args)`` method, whose futures have a ``result()``
+    method, for the *backend* 'processes' or 'dask'. For Dask, a LocalCluster with *n_workers* single
+    threaded workers is started unless the address of a *scheduler* is given.
+    """
+    if backend == "processes":
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+
+        # workers are spawned, as forking a process with an initialized ROOT interpreter is not safe
+        with ProcessPoolExecutor(n_workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+            yield pool
+
+    elif backend == "dask":
+        from dask.distributed import Client, LocalCluster
+
+        if scheduler:
+            with Client(scheduler) as client:
+                yield client
+        else:
+            with LocalCluster(n_workers=n_workers, threads_per_worker=1, processes=True) as cluster:
+                with Client(cluster) as client:
+                    yield client
+
+    else:
+        raise ValueError(f"unknown backend {backend}")
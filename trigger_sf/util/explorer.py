@@ -0,0 +1,204 @@
+"""
+Interactive exploration of trigger efficiencies on merged histograms kept in memory, e.g. in a notebook:
+
+    from trigger_sf.tasks.efficiencies import CalculateEfficiencies
+    from trigger_sf.util.explorer import EfficiencyExplorer
+
+    task = CalculateEfficiencies(
+        channel="mm",
+        variables=["met", "ht"],
+        processes=["data", "dyjets", "ttbar"],
+        ref_category="mm_incl",
+        sig_ref_category="sig_pfht_trigger",
+    )
+    explorer = EfficiencyExplorer.from_targets([inp["histogram"] for inp in task.input()])
+    explorer.efficiency("mm_incl", "sig_pfht_trigger", processes=["ttbar"], variables=["ht"])
+
+The same queries can be served as JSON over HTTP with :py:func:`serve`.
+"""
+
+from __future__ import annotations
+from functools import lru_cache
+import json
+from typing import Dict, Iterable, Optional, Sequence
+from urllib.parse import parse_qs, urlparse
+
+import hist
+import numpy as np
+
+from trigger_sf.util.histograms import (
+    as_weight_storage, calculate_efficiencies, calculate_scale_factors, merge_histograms,
+)
+
+
+def _rebin_axis(h: hist.Hist, name: str, edges: Sequence[float]) -> hist.Hist:
+    # merge bins of a variable axis, the new edges have to be a subset of the existing ones
+    axis = h.axes[name]
+    old_edges = np.asarray(axis.edges)
+    indices = np.searchsorted(old_edges, edges)
+    if len(edges) < 2 or np.any(indices >= len(old_edges)) or not np.allclose(old_edges[indices], edges):
+        raise ValueError(f"binning {list(edges)} of {name} is not a subset of {old_edges.tolist()}")
+
+    # target index in the flow view of the new axis for each bin in the flow view of the old axis; bins
+    # outside of the new range go to under- and overflow, or are dropped if the axis has none
+    n_under = int(axis.traits.underflow)
+    n_new = len(edges) - 1
+    overflow_index = n_new + n_under if axis.traits.overflow else -1
+    mapping = [0] if axis.traits.underflow else []
+    for j in range(len(old_edges) - 1):
+        if j < indices[0]:
+            mapping.append(0 if axis.traits.underflow else -1)
+        elif j >= indices[-1]:
+            mapping.append(overflow_index)
+        else:
+            mapping.append(int(np.searchsorted(indices, j, side="right")) - 1 + n_under)
+    if axis.traits.overflow:
+        mapping.append(overflow_index)
+
+    # sum values and variances of the merged bins
+    i = h.axes.name.index(name)
+    new_axes = list(h.axes)
+    new_axes[i] = hist.axis.Variable(
+        edges, name=name, underflow=axis.traits.underflow, overflow=axis.traits.overflow,
+    )
+    h_new = hist.Hist(*new_axes, storage=h.storage_type())
+    view, new_view = h.view(flow=True), h_new.view(flow=True)
+    for field in ("value", "variance"):
+        src = np.moveaxis(view[field], i, 0)
+        dst = np.moveaxis(new_view[field], i, 0)
+        for source_index, target_index in enumerate(mapping):
+            if target_index >= 0:
+                dst[target_index] += src[source_index]
+    return h_new
+
+
+class EfficiencyExplorer(object):
+    """
+    Answers projection, rebinning, process-subset and ratio queries on a merged histogram as filled by
+    CreateHistograms. Computed efficiencies are kept in an LRU cache of size *cache_size*.
+    """
+
+    def __init__(self, histogram: hist.Hist, cache_size: int = 256):
+        # only the nominal histogram is explored
+        if "shift" in histogram.axes.name:
+            histogram = histogram[{"shift": "nominal"}]
+        if "replica" in histogram.axes.name:
+            histogram = histogram[{"replica": 0}]
+        # the weight storage gives all histograms the same layout; efficiencies only use the sums of
+        # weights, the variances of histograms filled with weights into the double profile are replaced by
+        # those of unit weights and must not be used as uncertainties of weighted MC
+        self.histogram = as_weight_storage(histogram, unit_weights=True)
+
+        self._cached_efficiency = lru_cache(maxsize=cache_size)(self._efficiency)
+
+    @classmethod
+    def from_histograms(cls, histograms: Iterable[hist.Hist], **kwargs) -> EfficiencyExplorer:
+        return cls(merge_histograms(histograms), **kwargs)
+
+    @classmethod
+    def from_targets(cls, targets: Iterable, **kwargs) -> EfficiencyExplorer:
+        return cls.from_histograms((target.load(formatter="pickle") for target in targets), **kwargs)
+
+    @property
+    def variables(self):
+        return [name for name in self.histogram.axes.name if name not in ("category", "process")]
+
+    @property
+    def processes(self):
+        return list(self.histogram.axes["process"])
+
+    def select(
+        self,
+        variables: Optional[Sequence[str]] = None,
+        binnings: Optional[Dict[str, Sequence[float]]] = None,
+    ) -> hist.Hist:
+        # project onto the requested variables (summing over all others) and merge bins
+        h = self.histogram
+        if variables:
+            h = h.project("category", "process", *variables)
+        for name, edges in (binnings or {}).items():
+            h = _rebin_axis(h, name, edges)
+        return h
+
+    def _efficiency(self, ref_category, sig_ref_category, processes, variables, binnings):
+        # arguments are hashable for the cache, binnings are given as pairs of variable name and edges
+        h = self.select(variables=list(variables), binnings={name: list(edges) for name, edges in binnings})
+        processes = list(processes) or self.processes
+        return calculate_efficiencies(h, ref_category, sig_ref_category, processes)
+
+    def efficiency(
+        self,
+        ref_category: str,
+        sig_ref_category: str,
+        processes: Sequence[str] = (),
+        variables: Sequence[str] = (),
+        binnings: Optional[Dict[str, Sequence[float]]] = None,
+    ) -> Dict[str, np.ndarray]:
+        binnings = tuple(sorted((name, tuple(edges)) for name, edges in (binnings or {}).items()))
+        return self._cached_efficiency(
+            ref_category, sig_ref_category, tuple(processes), tuple(variables), binnings,
+        )
+
+    def scale_factor(
+        self,
+        ref_category: str,
+        sig_ref_category: str,
+        data_processes: Sequence[str],
+        mc_processes: Sequence[str],
+        variables: Sequence[str] = (),
+        binnings: Optional[Dict[str, Sequence[float]]] = None,
+    ) -> Dict[str, np.ndarray]:
+        eff_data = self.efficiency(ref_category, sig_ref_category, data_processes, variables, binnings)
+        eff_mc = self.efficiency(ref_category, sig_ref_category, mc_processes, variables, binnings)
+        return calculate_scale_factors(eff_data, eff_mc)
+
+    def query(self, params: Dict[str, str]) -> Dict:
+        # translate query string parameters into a cached efficiency or scale factor computation
+        split = lambda key: tuple(v for v in params.get(key, "").split(",") if v)
+        variables = split("variables")
+        binnings = {
+            key[len("binning."):]: [float(e) for e in value.split(",")]
+            for key, value in params.items()
+            if key.startswith("binning.")
+        }
+        if params.get("mode", "efficiency") == "scale_factor":
+            result = self.scale_factor(
+                params["ref_category"], params["sig_ref_category"],
+                split("data_processes"), split("mc_processes"), variables, binnings,
+            )
+        else:
+            result = self.efficiency(
+                params["ref_category"], params["sig_ref_category"], split("processes"), variables, binnings,
+            )
+        return {key: np.where(np.isfinite(value), value, None).tolist() for key, value in result.items()}
+
+
+def serve(explorer: EfficiencyExplorer, host: str = "localhost", port: int = 8765):
+    """
+    Serve the queries of an *explorer* as JSON, e.g.
+    ``/efficiency?ref_category=mm_incl&sig_ref_category=sig_pfht_trigger&processes=ttbar&variables=ht``.
+    """
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+            params.setdefault("mode", url.path.strip("/") or "efficiency")
+            try:
+                status, body = 200, explorer.query(params)
+            except (KeyError, ValueError) as e:
+                status, body = 400, {"error": str(e)}
+            payload = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
@@ -0,0 +1,154 @@
+from __future__ import annotations
+import logging
+import subprocess
+import sys
+import time
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+
+logger = logging.getLogger(__name__)
+
+
+def tree_entries(uri: str, tree_name: str) -> int:
+    import ROOT
+
+    # open the file and read the number of entries of the tree, which requires reading the file header
+    f = ROOT.TFile.Open(uri, "READ")
+    if not f or f.IsZombie():
+        raise IOError(f"cannot open {uri}")
+    try:
+        tree = f.Get(tree_name)
+        if not tree:
+            raise IOError(f"tree {tree_name} not found in {uri}")
+        return int(tree.GetEntries())
+    finally:
+        f.Close()
+
+
+def check_file(uri: str, tree_name: str, timeout: float) -> int:
+    """
+    Return the number of entries of the tree *tree_name* in the file *uri*. Opening a file can hang in the
+    storage client, so the check runs in a subprocess, which is killed when it does not finish within
+    *timeout* seconds. Thereby, no ROOT state of the calling process is shared with a hanging open and
+    several files can be checked concurrently from threads.
+    """
+    script = "import sys; from trigger_sf.util.files import tree_entries; print(tree_entries(*sys.argv[1:]))"
+    try:
+        result = subprocess.run(
+            [sys.executable, "-c", script, uri, tree_name],
+            capture_output=True,
+            text=True,
+            timeout=timeout,
+        )
+    except subprocess.TimeoutExpired:
+        raise TimeoutError(f"checking {uri} timed out after {timeout}s")
+    if result.returncode != 0:
+        lines = result.stderr.strip().splitlines()
+        raise IOError(lines[-1] if lines else f"checking {uri} failed")
+    return int(result.stdout.strip().splitlines()[-1])
+
+
+def print_tree_entries(tree_name: str, *uris: str):
+    # print the number of entries per file as soon as it is known, failures are reported on stderr
+    for uri in uris:
+        try:
+            print(f"{tree_entries(uri, tree_name)}\t{uri}", flush=True)
+        except Exception as e:
+            print(f"{uri}: {e}", file=sys.stderr, flush=True)
+
+
+def check_files(uris: Sequence[str], tree_name: str, timeout: float) -> Dict[str, int]:
+    """
+    Return the numbers of entries of the tree *tree_name* in all files *uris*, which could be opened. All
+    files are checked in a single subprocess, which is killed when it does not finish within *timeout*
+    seconds per file, so that ROOT is only imported once for many files. Files, which failed or were not
+    checked before the subprocess was killed, are missing in the returned mapping and can be checked again
+    with :py:func:`resolve_file`.
+    """
+    if not uris:
+        return {}
+    script = "import sys; from trigger_sf.util.files import print_tree_entries; print_tree_entries(*sys.argv[1:])"
+    try:
+        stdout = subprocess.run(
+            [sys.executable, "-c", script, tree_name, *uris],
+            capture_output=True,
+            text=True,
+            timeout=timeout * len(uris),
+        ).stdout
+    except subprocess.TimeoutExpired as e:
+        logger.warning(f"checking {len(uris)} files timed out after {timeout * len(uris)}s")
+        stdout = e.stdout or ""
+        if isinstance(stdout, bytes):
+            stdout = stdout.decode("utf-8", errors="replace")
+
+    entries, requested = {}, set(uris)
+    for line in stdout.splitlines():
+        n, sep, uri = line.partition("\t")
+        if sep and uri in requested and n.isdigit():
+            entries[uri] = int(n)
+    return entries
+
+
+def resolve_file(
+    candidates: Sequence[str | Callable[[], str]],
+    tree_name: str,
+    timeout: float = 60.0,
+    retries: int = 2,
+    backoff: float = 1.0,
+) -> Optional[Tuple[str, int]]:
+    """
+    Return the first of the *candidates* that can be opened and contains the tree *tree_name*, together
+    with the number of entries of the tree. Each candidate is tried up to *retries* + 1 times with
+    exponential backoff starting at *backoff* seconds. Candidates can also be callables, which are only
+    evaluated when all previous candidates failed (e.g. to fetch a local copy of the file). Returns None if
+    no candidate is usable.
+    """
+    for candidate in candidates:
+        for attempt in range(retries + 1):
+            try:
+                uri = candidate() if callable(candidate) else candidate
+                return uri, check_file(uri, tree_name, timeout)
+            except Exception as e:
+                logger.warning(f"attempt {attempt + 1}/{retries + 1} failed: {e or type(e).__name__}")
+                if attempt < retries:
+                    time.sleep(backoff * 2 ** attempt)
+
+    return None
+
+
+def replica_uris(uri: str, base: str, replica_bases: Sequence[str]) -> List[str]:
+    # alternative locations of a file, obtained by exchanging the base of its uri
+    if not uri.startswith(base):
+        return []
+    return [replica_base + uri[len(base):] for replica_base in replica_bases]
+
+
+def read_event_counts(uri: str, tree_name: str, count_branch: str, sumw_branch: str) -> Optional[dict]:
+    """
+    Read the number of generated events and the sum of generator weights of a file from its small summary
+    tree, which holds one entry per job of the ntuple production. Returns None if the file has no summary
+    tree or the tree has no *count_branch*, e.g. for data.
+    """
+    import ROOT
+
+    f = ROOT.TFile.Open(uri, "READ")
+    if not f or f.IsZombie():
+        raise IOError(f"cannot open {uri}")
+    try:
+        tree = f.Get(tree_name)
+        if not tree:
+            return None
+        branches = {b.GetName() for b in tree.GetListOfBranches()}
+        if count_branch not in branches:
+            return None
+        n_events, sum_gen_weights = 0, 0.0
+        for entry in tree:
+            n_events += int(getattr(entry, count_branch))
+            if sumw_branch in branches:
+                sum_gen_weights += float(getattr(entry, sumw_branch))
+        return {
+            "n_events": n_events,
+            "sum_gen_weights": sum_gen_weights if sumw_branch in branches else None,
+        }
+    finally:
+        f.Close()
@@ -1,23 +1,215 @@
 import hist
+import numpy as np
 
+from trigger_sf.util.storage import STORAGE_PROFILES
 
-def create_hist(config, variables):
-    category_names = list(config.categories.names())
-    process_names = list(config.processes.names())
+
+def create_hist(
+    config,
+    variables,
+    binnings=None,
+    n_replicas=0,
+    shifts=None,
+    storage="weight",
+    is_data=False,
+    categories=None,
+    processes=None,
+):
+    if storage not in STORAGE_PROFILES:
+        raise ValueError(f"unknown storage profile {storage}, known profiles are {STORAGE_PROFILES}")
+
+    # sparse histograms only allocate the given categories and processes, and grow when others are filled
+    growth = storage == "sparse"
+    category_names = list(categories or []) if growth else list(config.categories.names())
+    process_names = list(processes or []) if growth else list(config.processes.names())
 
     # create categorical axes
     axes = [
-        hist.axis.StrCategory(category_names, name="category"),
-        hist.axis.StrCategory(process_names, name="process"),
+        hist.axis.StrCategory(category_names, name="category", growth=growth),
+        hist.axis.StrCategory(process_names, name="process", growth=growth),
     ]
 
-    # create variable axes
+    # create variable axes, the binning of a variable can be overridden
+    binnings = binnings or {}
     for variable in variables:
         axes.append(hist.axis.Variable(
-            variable.bin_edges, underflow=True, overflow=True, name=variable.name
+            binnings.get(variable.name, variable.bin_edges), underflow=True, overflow=True, name=variable.name
         ))
 
+    # axis for bootstrap replicas, index 0 holds the nominal histogram
+    if n_replicas > 0:
+        axes.append(hist.axis.Integer(0, n_replicas + 1, underflow=False, overflow=False, name="replica"))
+
+    # axis for systematic shifts
+    if shifts:
+        axes.append(hist.axis.StrCategory(list(shifts), name="shift"))
+
     # create the full histogram
-    h = hist.Hist(*axes, storage=hist.storage.Weight())
+    if storage == "double":
+        h = hist.Hist(*axes, storage=hist.storage.Double())
+    elif storage == "compact" and is_data:
+        h = hist.Hist(*axes, storage=hist.storage.Unlimited())
+    else:
+        h = hist.Hist(*axes, storage=hist.storage.Weight())
+
+    return h
+
+
+def fill_hist(h, *args, weight=None):
+    # counting storages only keep their variances if they are filled without weights
+    if weight is None or (not isinstance(h.storage_type(), hist.storage.Weight) and np.all(weight == 1)):
+        h.fill(*args)
+    else:
+        h.fill(*args, weight=weight)
+    return h
+
+
+def as_weight_storage(h, unit_weights=False):
+    """
+    Convert a histogram to the weight storage. The variances of a histogram, which was filled with weights
+    into a storage without variances (the double profile for MC), are unknown; they are only replaced by
+    the values, i.e. the variances of unit weights, if *unit_weights* is set, and raise an error otherwise.
+    """
+    if isinstance(h.storage_type(), hist.storage.Weight):
+        return h
+    variances = h.variances(flow=True)
+    if variances is None:
+        if not unit_weights:
+            raise ValueError(
+                "variances of the histogram are unknown, as it was filled with weights into a storage "
+                "without variances",
+            )
+        variances = h.values(flow=True)
+    h_weight = hist.Hist(*h.axes, storage=hist.storage.Weight())
+    view = h_weight.view(flow=True)
+    view["value"] = h.values(flow=True)
+    view["variance"] = variances
+    return h_weight
+
+
+def as_double_storage(h):
+    # convert a histogram to the double storage, which only keeps the sums of weights
+    if isinstance(h.storage_type(), hist.storage.Double):
+        return h
+    h_double = hist.Hist(*h.axes, storage=hist.storage.Double())
+    h_double.view(flow=True)[...] = h.values(flow=True)
+    return h_double
+
+
+def merge_histograms(histograms):
+    # sum histograms, which are converted to the weight storage if their storages differ; if the variances
+    # of one histogram are unknown, only the sums of weights are merged, so that the merged variances stay
+    # unknown instead of being replaced by those of unit weights
+    histograms = list(histograms)
+    if len(set(type(h.storage_type()) for h in histograms)) > 1:
+        if any(h.variances() is None for h in histograms):
+            histograms = [as_double_storage(h) for h in histograms]
+        else:
+            histograms = [as_weight_storage(h) for h in histograms]
+    merged = None
+    for h in histograms:
+        merged = h if merged is None else merged + h
+    return merged
+
+
+def calculate_efficiencies(histogram, ref_category, sig_ref_category, processes):
+    import hist.intervals
+
+    # central values of the efficiencies for all systematic shifts
+    shifted = {}
+    if "shift" in histogram.axes.name:
+        for shift in histogram.axes["shift"]:
+            if shift == "nominal":
+                continue
+            h_shift = histogram[{"shift": shift}]
+            shifted[shift] = (
+                h_shift[sig_ref_category, processes, ...][hist.sum, ...].values()
+                / h_shift[ref_category, processes, ...][hist.sum, ...].values()
+            )
+        histogram = histogram[{"shift": "nominal"}]
+
+    # get histogram for ref and for sig_ref category
+    h_ref = histogram[ref_category, processes, ...][hist.sum, ...]
+    h_sig_ref = histogram[sig_ref_category, processes, ...][hist.sum, ...]
+
+    # separate nominal values and bootstrap replicas
+    values_ref = h_ref.values()
+    values_sig_ref = h_sig_ref.values()
+    has_replicas = "replica" in h_ref.axes.name
+    if has_replicas:
+        replicas_ref = np.moveaxis(values_ref[..., 1:], -1, 0)
+        replicas_sig_ref = np.moveaxis(values_sig_ref[..., 1:], -1, 0)
+        values_ref = values_ref[..., 0]
+        values_sig_ref = values_sig_ref[..., 0]
+
+    # divide histograms
+    eff_nominal = values_sig_ref / values_ref
+    eff_shift = hist.intervals.clopper_pearson_interval(values_sig_ref, values_ref, coverage=0.68)
+    eff_down = eff_shift[0, ...]
+    eff_up = eff_shift[1, ...]
+
+    efficiencies = {
+        "nominal": eff_nominal,
+        "up": eff_up,
+        "down": eff_down,
+    }
+
+    # efficiencies of all replicas at once, the spread gives the bootstrap uncertainty
+    if has_replicas:
+        efficiencies.update(_bootstrap_variations(eff_nominal, replicas_sig_ref / replicas_ref))
+
+    efficiencies.update(shifted)
+
+    return efficiencies
+
+
+def _bootstrap_variations(nominal, replicas):
+    std = np.nanstd(replicas, axis=0)
+    return {
+        "replicas": replicas,
+        "bootstrap_up": nominal + std,
+        "bootstrap_down": nominal - std,
+    }
+
+
+def calculate_scale_factors(eff_data, eff_mc, shifts=()):
+    # perform division and error estimation
+    scale_factors = {
+        "nominal": eff_data["nominal"] / eff_mc["nominal"],
+        "up": eff_data["up"] / eff_mc["down"],
+        "down": eff_data["down"] / eff_mc["up"],
+    }
+
+    # data and MC replicas are independent, so they can be divided replica by replica
+    if "replicas" in eff_data and "replicas" in eff_mc:
+        scale_factors.update(_bootstrap_variations(
+            scale_factors["nominal"],
+            eff_data["replicas"] / eff_mc["replicas"],
+        ))
+
+    # systematic shifts are evaluated with the shifted efficiencies in data and MC
+    for shift in shifts:
+        scale_factors[shift] = eff_data[shift] / eff_mc[shift]
+
+    return scale_factors
+
+
+def fill_root_histogram(h, th, category, process, shift=None):
+    # bin contents and squared errors of the ROOT histogram including flow bins; ROOT counts global bins
+    # with the x axis running fastest
+    ndim = th.GetDimension()
+    axes = [th.GetXaxis(), th.GetYaxis(), th.GetZaxis()][:ndim]
+    shape = tuple(axis.GetNbins() + 2 for axis in axes)[::-1]
+    n_cells = th.GetNcells()
+    values = np.array([th.GetBinContent(i) for i in range(n_cells)]).reshape(shape).T
+    variances = np.array([th.GetBinError(i) ** 2 for i in range(n_cells)]).reshape(shape).T
+
+    # add the contents to the matching slice of the flow view, whose layout matches the ROOT histogram
+    index = [h.axes["category"].index(category), h.axes["process"].index(process), Ellipsis]
+    if shift is not None:
+        index.append(h.axes["shift"].index(shift))
+    view = h.view(flow=True)
+    view["value"][tuple(index)] += values
+    view["variance"][tuple(index)] += variances
 
     return h
@@ -0,0 +1,104 @@
+"""
+Benchmark of the import time of the task modules, which is paid by every ``law run``, ``law index`` and
+shell completion. Each module is imported in a fresh interpreter with ``python -X importtime``:
+
+    python -m trigger_sf.util.importtime --budget 1.0 --output importtime.json
+
+The modules default to the ones registered in the law config. The exit code is non-zero if a module
+exceeds the budget or imports one of the modules, which should only be loaded when a task runs. With
+--output, the results are written to a JSON file, which can be compared between versions.
+"""
+
+from __future__ import annotations
+import argparse
+import configparser
+import json
+import os
+import subprocess
+import sys
+from typing import Dict, List, Sequence
+
+
+# modules, which must not be imported when indexing the tasks
+DEFERRED_MODULES = ("ROOT", "matplotlib", "mplhep", "hist", "gfal2", "law.contrib.wlcg", "law.contrib.matplotlib")
+
+
+def law_modules(config_file: str) -> List[str]:
+    # module names are the keys of the 'modules' section of the law config
+    parser = configparser.ConfigParser(allow_no_value=True, interpolation=None)
+    parser.optionxform = str
+    parser.read(config_file)
+    return list(parser["modules"].keys()) if parser.has_section("modules") else []
+
+
+def measure_import(module: str) -> Dict[str, Dict[str, float]]:
+    """
+    Import *module* in a fresh interpreter and return the self and cumulative import times in seconds of
+    all modules imported along the way.
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        raise ImportError(f"importing {module} failed:\n{result.stderr.strip().splitlines()[-1]}")
+
+    # lines have the format 'import time: <self us> | <cumulative us> | <indented name>'
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        times[name.strip()] = {"self": int(self_us) * 1e-6, "cumulative": int(cumulative_us) * 1e-6}
+    return times
+
+
+def benchmark(modules: Sequence[str], budget: float = 1.0) -> Dict[str, Dict]:
+    """
+    Measure the import time of each of the *modules* and return, per module, the total time, the imported
+    deferred modules, whether the module passed the *budget* and the times of all its imports.
+    """
+    results = {}
+    for module in modules:
+        times = measure_import(module)
+        total = times[module]["cumulative"]
+        deferred = [m for m in DEFERRED_MODULES if m in times]
+        results[module] = {
+            "total": total,
+            "deferred": deferred,
+            "passed": total <= budget and not deferred,
+            "imports": times,
+        }
+    return results
+
+
+def main(args: Sequence[str] = None) -> Dict[str, Dict]:
+    parser = argparse.ArgumentParser(description="measure the import time of the task modules")
+    parser.add_argument("modules", nargs="*", help="modules to import; default: modules of the law config")
+    parser.add_argument(
+        "--config", "-c", default=os.getenv("LAW_CONFIG_FILE", "law.cfg"), help="law config to read modules from",
+    )
+    parser.add_argument("--budget", "-b", type=float, default=1.0, help="import time budget per module in seconds")
+    parser.add_argument("--top", "-t", type=int, default=5, help="number of slowest imports to show per module")
+    parser.add_argument("--output", "-o", help="JSON file to write the results to")
+    args = parser.parse_args(args)
+
+    results = benchmark(args.modules or law_modules(args.config), budget=args.budget)
+    for module, result in results.items():
+        print(f"{module}: {result['total']:.3f}s ({'ok' if result['passed'] else 'FAILED'})")
+        slowest = sorted(result["imports"].items(), key=lambda item: item[1]["self"], reverse=True)[:args.top]
+        for name, t in slowest:
+            print(f"    {name}: {t['self']:.3f}s self, {t['cumulative']:.3f}s cumulative")
+        if result["deferred"]:
+            print(f"    imports deferred modules: {', '.join(result['deferred'])}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"python": sys.version, "budget": args.budget, "modules": results}, f, indent=2)
+
+    return results
+
+
+if __name__ == "__main__":
+    sys.exit(int(not all(result["passed"] for result in main().values())))
@@ -0,0 +1,141 @@
+from __future__ import annotations
+import argparse
+import json
+import struct
+from typing import Dict, Sequence
+
+import numpy as np
+
+
+# magic bytes and header layout of the binary lookup table
+LOOKUP_MAGIC = b"TSFLUT01"
+LOOKUP_HEADER = struct.Struct("<8sQ")
+
+
+def sanitize_values(values: np.ndarray, fill_value: float = 1.0) -> np.ndarray:
+    # bins without entries (NaN) or with vanishing MC efficiency (inf) are set to the fill value
+    values = np.asarray(values, dtype=np.float64)
+    return np.where(np.isfinite(values), values, fill_value)
+
+
+def correctionlib_json(
+    name: str,
+    variables: Sequence[str],
+    edges: Sequence[Sequence[float]],
+    scale_factors: Dict[str, np.ndarray],
+    description: str = "",
+) -> Dict:
+    # one multibinning node per variation, selected with a category node on the 'variation' input
+    content = [
+        {
+            "key": variation,
+            "value": {
+                "nodetype": "multibinning",
+                "inputs": list(variables),
+                "edges": [[float(e) for e in _edges] for _edges in edges],
+                "content": sanitize_values(values).ravel(order="C").tolist(),
+                "flow": "clamp",
+            },
+        }
+        for variation, values in scale_factors.items()
+    ]
+    return {
+        "schema_version": 2,
+        "corrections": [
+            {
+                "name": name,
+                "description": description,
+                "version": 1,
+                "inputs": (
+                    [{"name": variable, "type": "real"} for variable in variables]
+                    + [{"name": "variation", "type": "string"}]
+                ),
+                "output": {"name": "sf", "type": "real"},
+                "data": {
+                    "nodetype": "category",
+                    "input": "variation",
+                    "content": content,
+                },
+            },
+        ],
+    }
+
+
+def write_lookup_table(
+    path: str,
+    variables: Sequence[str],
+    edges: Sequence[Sequence[float]],
+    scale_factors: Dict[str, np.ndarray],
+):
+    # the header describes the layout of the contiguous float32 values, which follow it
+    variations = list(scale_factors.keys())
+    shape = [len(_edges) - 1 for _edges in edges]
+    header = json.dumps({
+        "variables": list(variables),
+        "edges": [[float(e) for e in _edges] for _edges in edges],
+        "variations": variations,
+        "shape": shape,
+    }).encode("utf-8")
+    values = np.stack([sanitize_values(scale_factors[v]) for v in variations]).astype("<f4")
+
+    with open(path, mode="wb") as f:
+        f.write(LOOKUP_HEADER.pack(LOOKUP_MAGIC, len(header)))
+        f.write(header)
+        f.write(values.tobytes(order="C"))
+
+
+class ScaleFactorLookup(object):
+    """
+    Vectorised evaluation of scale factors from a binary lookup table written by
+    :py:func:`write_lookup_table`. Values outside of the binning are clamped to the first or last bin.
+    """
+
+    def __init__(self, path: str):
+        with open(path, mode="rb") as f:
+            buffer = f.read()
+
+        # parse the header
+        magic, header_size = LOOKUP_HEADER.unpack_from(buffer)
+        if magic != LOOKUP_MAGIC:
+            raise ValueError(f"{path} is not a scale factor lookup table")
+        offset = LOOKUP_HEADER.size
+        header = json.loads(buffer[offset:offset + header_size].decode("utf-8"))
+        offset += header_size
+
+        self.variables = header["variables"]
+        self.edges = [np.array(_edges, dtype=np.float64) for _edges in header["edges"]]
+        self.variations = header["variations"]
+        self.values = np.frombuffer(buffer, dtype="<f4", offset=offset).reshape(
+            [len(self.variations)] + header["shape"]
+        )
+
+    def bin_indices(self, *values):
+        if len(values) != len(self.variables):
+            raise ValueError(f"expected values for the variables {self.variables}, got {len(values)} arrays")
+
+        # search the bins of all values of one variable at once, clamp under- and overflow
+        return tuple(
+            np.clip(np.searchsorted(_edges, np.asarray(v), side="right") - 1, 0, len(_edges) - 2)
+            for _edges, v in zip(self.edges, values)
+        )
+
+    def evaluate(self, *values, variation: str = "nominal"):
+        return self.values[(self.variations.index(variation), ) + self.bin_indices(*values)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="query trigger scale factors from a lookup table")
+    parser.add_argument("table", help="path to the binary lookup table")
+    parser.add_argument("values", nargs="+", type=float, help="value of each variable of the table")
+    parser.add_argument("--variation", "-v", default=None, help="variation to query; default: all variations")
+    args = parser.parse_args()
+
+    lookup = ScaleFactorLookup(args.table)
+    variations = [args.variation] if args.variation else lookup.variations
+    for variation in variations:
+        sf = lookup.evaluate(*[np.array([v]) for v in args.values], variation=variation)[0]
+        print(f"{variation}: {sf:.6f}")
+
+
+if __name__ == "__main__":
+    main()
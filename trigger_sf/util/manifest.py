@@ -0,0 +1,132 @@
+from __future__ import annotations
+from functools import cache
+import hashlib
+import os
+import sqlite3
+import time
+from typing import Iterable, Optional, Tuple
+
+
+MANIFEST_FILE_NAME = ".manifest.sqlite"
+
+
+def fingerprint(*parts: Iterable[str] | str) -> str:
+    # hash the string representation of all parts in a fixed order
+    h = hashlib.sha1()
+    for part in parts:
+        if isinstance(part, str):
+            part = [part]
+        for p in part:
+            h.update(str(p).encode("utf-8"))
+            h.update(b"\0")
+    return h.hexdigest()
+
+
+class OutputManifest(object):
+    """
+    Index of finished task outputs in a single SQLite file per local store. For each task, the hash of
+    its inputs at the time the outputs were written and a fingerprint of the outputs themselves are
+    recorded, so that completeness checks only need to query the manifest instead of all outputs and
+    their requirements. Whether the recorded outputs still exist is not tracked, since they can be deleted
+    outside of law; tasks check this separately (see *AnalysisTask.stat_outputs*).
+
+    The manifest uses the default rollback journal of SQLite, which only relies on file locks and, unlike
+    the write-ahead log, does not need shared memory between all processes accessing the database, so that
+    the store can reside on a network filesystem. Connections must not be shared between processes, use
+    :py:func:`get_manifest` to obtain the manifest of the current process.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._connection = None
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        if self._connection is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._connection = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+            self._connection.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS tasks (
+                    task_id TEXT PRIMARY KEY,
+                    input_hash TEXT NOT NULL,
+                    output_hash TEXT NOT NULL,
+                    created REAL NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS outputs (
+                    path TEXT PRIMARY KEY,
+                    task_id TEXT NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS outputs_task_id ON outputs (task_id);
+                """
+            )
+        return self._connection
+
+    def lookup(self, task_id: str) -> Optional[Tuple[str, str, Tuple[str, ...]]]:
+        # get the recorded hashes and output paths of a task, or None if the task is unknown
+        row = self.connection.execute(
+            "SELECT input_hash, output_hash FROM tasks WHERE task_id = ?",
+            (task_id,),
+        ).fetchone()
+        if row is None:
+            return None
+        paths = self.connection.execute(
+            "SELECT path FROM outputs WHERE task_id = ?",
+            (task_id,),
+        ).fetchall()
+        return row[0], row[1], tuple(sorted(p[0] for p in paths))
+
+    def output_hash(self, task_id: str) -> Optional[str]:
+        row = self.connection.execute(
+            "SELECT output_hash FROM tasks WHERE task_id = ?",
+            (task_id,),
+        ).fetchone()
+        return None if row is None else row[0]
+
+    def check(self, task_id: str, input_hash: str, paths: Iterable[str]) -> Optional[bool]:
+        """
+        Return *True* if the task is recorded with the same inputs and outputs, *False* if the record
+        is outdated and *None* if the task is not recorded at all.
+        """
+        record = self.lookup(task_id)
+        if record is None:
+            return None
+        recorded_input_hash, _, recorded_paths = record
+        return recorded_input_hash == input_hash and recorded_paths == tuple(sorted(paths))
+
+    def record(self, task_id: str, input_hash: str, paths: Iterable[str]):
+        # the output hash changes with every execution, so that dependent tasks become outdated
+        paths = sorted(paths)
+        created = time.time()
+        output_hash = fingerprint(task_id, input_hash, paths, repr(created))
+        with self.connection:
+            self.connection.execute("BEGIN IMMEDIATE")
+            self.connection.execute("DELETE FROM outputs WHERE task_id = ?", (task_id,))
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO outputs (path, task_id) VALUES (?, ?)",
+                [(path, task_id) for path in paths],
+            )
+            self.connection.execute(
+                "INSERT OR REPLACE INTO tasks (task_id, input_hash, output_hash, created) VALUES (?, ?, ?, ?)",
+                (task_id, input_hash, output_hash, created),
+            )
+        return output_hash
+
+    def forget(self, path: str):
+        # remove the task owning the output path, as its set of outputs is not complete anymore
+        with self.connection:
+            self.connection.execute("BEGIN IMMEDIATE")
+            row = self.connection.execute("SELECT task_id FROM outputs WHERE path = ?", (path,)).fetchone()
+            if row is not None:
+                self.connection.execute("DELETE FROM outputs WHERE task_id = ?", (row[0],))
+                self.connection.execute("DELETE FROM tasks WHERE task_id = ?", (row[0],))
+
+
+def get_manifest(store: str) -> OutputManifest:
+    # sqlite connections must not be used across forks, so each process opens its own connection
+    return _get_manifest(store, os.getpid())
+
+
+@cache
+def _get_manifest(store: str, pid: int) -> OutputManifest:
+    return OutputManifest(os.path.join(store, MANIFEST_FILE_NAME))
@@ -0,0 +1,241 @@
+"""
+Live metrics of running tasks in the Prometheus text format. Metrics are only exported if configured
+with environment variables:
+
+    TSF_METRICS_PORT      port of a local HTTP server, which serves the metrics at /metrics
+    TSF_METRICS_FILE      JSONL file, to which a snapshot of all metrics is appended periodically
+    TSF_METRICS_INTERVAL  interval of the snapshots in seconds; default: 10
+    TSF_METRICS_MAX_MB    size in MB, after which the JSONL file is rotated to <file>.1; default: 50
+
+Updating a metric only takes a lock and a dictionary update, so that metrics can also be updated from
+the progress callbacks of event loops. Only the scheduling process, i.e. the first process importing this
+module, exports its metrics; worker processes inherit TSF_METRICS_OWNER_PID and do not start exporters.
+"""
+
+from __future__ import annotations
+import bisect
+from contextlib import contextmanager
+from functools import cache
+import json
+import logging
+import os
+import threading
+import time
+from typing import Dict, Optional, Sequence, Tuple
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0, 600.0, 1800.0, 3600.0)
+
+# the first process importing this module owns the exporters, spawned and forked worker processes inherit
+# the variable
+os.environ.setdefault("TSF_METRICS_OWNER_PID", str(os.getpid()))
+
+
+def _label_string(labels: Tuple[Tuple[str, str], ...], extra: Dict[str, str] = None) -> str:
+    items = list(labels) + list((extra or {}).items())
+    if not items:
+        return ""
+    escape = lambda v: str(v).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+    return "{" + ",".join(f"{key}=\"{escape(value)}\"" for key, value in items) + "}"
+
+
+class MetricsRegistry(object):
+    """
+    Thread-safe collection of counters, gauges and histograms, identified by their name and labels.
+    """
+
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        self._types = {}
+        self._help = {}
+        self._values = {}
+        self._histograms = {}
+
+    def _key(self, name, kind, help, labels):
+        if self._types.setdefault(name, kind) != kind:
+            raise ValueError(f"metric {name} is a {self._types[name]}, not a {kind}")
+        if help:
+            self._help.setdefault(name, help)
+        return name, tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+    def inc(self, name: str, value: float = 1.0, help: str = "", **labels):
+        with self._lock:
+            key = self._key(name, "counter", help, labels)
+            self._values[key] = self._values.get(key, 0.0) + value
+
+    def set(self, name: str, value: float, help: str = "", **labels):
+        with self._lock:
+            self._values[self._key(name, "gauge", help, labels)] = float(value)
+
+    def add(self, name: str, value: float, help: str = "", **labels):
+        # relative change of a gauge, e.g. the number of running tasks
+        with self._lock:
+            key = self._key(name, "gauge", help, labels)
+            self._values[key] = self._values.get(key, 0.0) + value
+
+    def observe(self, name: str, value: float, help: str = "", **labels):
+        with self._lock:
+            key = self._key(name, "histogram", help, labels)
+            counts, total = self._histograms.get(key, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self._histograms[key] = (counts, total + value)
+
+    @contextmanager
+    def timer(self, name: str, help: str = "", **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, help=help, **labels)
+
+    def snapshot(self) -> Dict:
+        # plain copy of all metrics, e.g. for the JSONL export
+        with self._lock:
+            values = [
+                {"name": name, "labels": dict(labels), "value": value}
+                for (name, labels), value in self._values.items()
+            ]
+            histograms = [
+                {"name": name, "labels": dict(labels), "buckets": list(self.buckets), "counts": list(counts),
+                 "sum": total}
+                for (name, labels), (counts, total) in self._histograms.items()
+            ]
+        return {"time": time.time(), "values": values, "histograms": histograms}
+
+    def render(self) -> str:
+        # prometheus text exposition format
+        with self._lock:
+            lines = []
+            for name, kind in sorted(self._types.items()):
+                if name in self._help:
+                    lines.append(f"# HELP {name} {self._help[name]}")
+                lines.append(f"# TYPE {name} {kind}")
+                if kind != "histogram":
+                    for (_name, labels), value in sorted(self._values.items()):
+                        if _name == name:
+                            lines.append(f"{name}{_label_string(labels)} {value!r}")
+                    continue
+                for (_name, labels), (counts, total) in sorted(self._histograms.items()):
+                    if _name != name:
+                        continue
+                    cumulative = 0
+                    for bound, count in zip(self.buckets + (float("inf"), ), counts):
+                        cumulative += count
+                        le = "+Inf" if bound == float("inf") else repr(bound)
+                        lines.append(f"{name}_bucket{_label_string(labels, {'le': le})} {cumulative}")
+                    lines.append(f"{name}_sum{_label_string(labels)} {total!r}")
+                    lines.append(f"{name}_count{_label_string(labels)} {cumulative}")
+        return "\n".join(lines) + "\n"
+
+
+def parse_prometheus(text: str) -> Dict[str, float]:
+    # minimal parser of the text format, mapping '<name>{<labels>}' to values, e.g. to check a scrape
+    samples = {}
+    for line in text.splitlines():
+        if line and not line.startswith("#"):
+            sample, value = line.rsplit(" ", 1)
+            samples[sample] = float(value)
+    return samples
+
+
+def serve(registry: MetricsRegistry, host: str = "localhost", port: int = 9464):
+    """
+    Serve the metrics of the *registry* at /metrics from a daemon thread and return the server.
+    """
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            payload = registry.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def write_jsonl(registry: MetricsRegistry, path: str, interval: float = 10.0, max_bytes: int = 50 * 1024 ** 2):
+    """
+    Append a snapshot of the *registry* to the JSONL file *path* every *interval* seconds from a daemon
+    thread. The file is rotated to *path*.1 once it exceeds *max_bytes*. Returns the thread.
+    """
+    def write():
+        with open(path, mode="a") as f:
+            f.write(json.dumps(registry.snapshot()) + "\n")
+        if os.path.getsize(path) > max_bytes:
+            os.replace(path, path + ".1")
+
+    def loop():
+        while True:
+            time.sleep(interval)
+            try:
+                write()
+            except OSError as e:
+                logger.warning(f"cannot write metrics to {path}: {e}")
+
+    thread = threading.Thread(target=loop, daemon=True)
+    thread.start()
+    return thread
+
+
+def is_exporting_process() -> bool:
+    return os.getenv("TSF_METRICS_OWNER_PID") == str(os.getpid())
+
+
+def metrics_enabled() -> bool:
+    # callbacks in event loops are only booked if the metrics are exported by this process
+    return bool(os.getenv("TSF_METRICS_PORT") or os.getenv("TSF_METRICS_FILE")) and is_exporting_process()
+
+
+@cache
+def get_registry() -> MetricsRegistry:
+    """
+    Return the registry of this process, and start the exporters configured by the environment on the
+    first call in the scheduling process.
+    """
+    registry = MetricsRegistry()
+    if not is_exporting_process():
+        return registry
+
+    port = os.getenv("TSF_METRICS_PORT")
+    if port:
+        try:
+            serve(registry, port=int(port))
+        except OSError as e:
+            # e.g. the port is taken by another worker process
+            logger.warning(f"cannot serve metrics on port {port}: {e}")
+
+    path = os.getenv("TSF_METRICS_FILE")
+    if path:
+        write_jsonl(
+            registry,
+            os.path.expandvars(path),
+            interval=float(os.getenv("TSF_METRICS_INTERVAL", "10")),
+            max_bytes=int(float(os.getenv("TSF_METRICS_MAX_MB", "50")) * 1024 ** 2),
+        )
+
+    return registry
+
+
+def max_rss_bytes() -> Optional[int]:
+    # peak resident memory of this process, ru_maxrss is given in kB on linux
+    try:
+        import resource
+    except ImportError:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
@@ -75,3 +75,28 @@ def plot_2d_colormesh(
             )
 
     return fig, ax
+
+
+def figure_to_rgba(fig, dpi=100):
+    # render the figure once with the Agg backend and return the pixels as an array
+    import numpy as np
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+    canvas = FigureCanvasAgg(fig)
+    fig.set_dpi(dpi)
+    canvas.draw()
+    return np.asarray(canvas.buffer_rgba())
+
+
+def tile_images(images, n_columns=3):
+    import numpy as np
+
+    # pad all images to the same size and arrange them in a grid with white background
+    height = max(image.shape[0] for image in images)
+    width = max(image.shape[1] for image in images)
+    n_rows = (len(images) + n_columns - 1) // n_columns
+    tiled = np.full((n_rows * height, n_columns * width, 4), 255, dtype=np.uint8)
+    for i, image in enumerate(images):
+        row, column = divmod(i, n_columns)
+        tiled[row * height:row * height + image.shape[0], column * width:column * width + image.shape[1]] = image
+    return tiled
@@ -1,10 +1,133 @@
 from __future__ import annotations
+import ast
+import math
+import re
+from typing import Optional
+
+
+# identifiers in expressions, which are neither function calls, members nor literal suffixes
+IDENTIFIER_PATTERN = re.compile(r"(?<![\w.:])([A-Za-z_]\w*)(?!\s*[(\w:])")
+CXX_KEYWORDS = {"true", "false", "nullptr", "and", "or", "not", "static_cast", "const_cast", "reinterpret_cast"}
+# type names, which appear in casts and in the RVec expressions of variations, but are no columns
+CXX_TYPES = {
+    "bool", "char", "short", "int", "long", "unsigned", "signed", "float", "double", "auto", "size_t",
+    "Int_t", "UInt_t", "Long64_t", "ULong64_t", "Float_t", "Double_t", "Bool_t",
+}
+
+
+# python nodes, which constant C++ expressions may translate to; divisions are not folded, as integer
+# division and modulo differ between C++ and python (e.g. 1 / 2 is 0 in C++)
+CONSTANT_NODES = (
+    ast.Expression, ast.BoolOp, ast.UnaryOp, ast.BinOp, ast.Compare, ast.Constant,
+    ast.And, ast.Or, ast.Not, ast.USub, ast.UAdd, ast.Add, ast.Sub, ast.Mult,
+    ast.Eq, ast.NotEq, ast.Lt, ast.LtE, ast.Gt, ast.GtE,
+)
 
 
 def sanitize_expression(expression: str):
     return " ".join([part.strip() for part in expression.split("\n") if len(part.strip()) > 0])
 
 
+def _parse(expression: str) -> Optional[ast.Expression]:
+    # translate the C++ operators and literals to python and parse the expression; negations are only
+    # translated for single identifiers and parenthesized groups, so that they keep the C++ precedence
+    translated = re.sub(r"(\d\.?\d*)[fFuUlL]+\b", r"\1", expression)
+    translated = translated.replace("&&", " and ").replace("||", " or ")
+    translated = re.sub(r"!\s*(\w+|\([^()]*\))", r" (not \1) ", translated)
+    translated = re.sub(r"\btrue\b", "True", re.sub(r"\bfalse\b", "False", translated))
+    try:
+        return ast.parse(translated.strip(), mode="eval")
+    except SyntaxError:
+        return None
+
+
+def _constant(node: ast.AST):
+    # value of a node, which does not depend on any column, or None
+    if not all(isinstance(n, CONSTANT_NODES) for n in ast.walk(node)):
+        return None
+    # chained comparisons are evaluated pairwise in C++
+    if any(isinstance(n, ast.Compare) and len(n.ops) > 1 for n in ast.walk(node)):
+        return None
+    try:
+        return eval(compile(ast.fix_missing_locations(ast.Expression(node)), "<selection>", "eval"), {})
+    except (ArithmeticError, TypeError):
+        return None
+
+
+def _fold(node: ast.AST) -> Optional[bool]:
+    # three-valued evaluation of a condition, which is None if its value depends on columns; conjunctions
+    # and disjunctions are decided by their constant operands, e.g. ``1 == 0 && x`` is always false
+    if isinstance(node, ast.BoolOp):
+        values = [_fold(value) for value in node.values]
+        decisive = isinstance(node.op, ast.Or)
+        if any(value is decisive for value in values):
+            return decisive
+        return (not decisive) if all(value is (not decisive) for value in values) else None
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.Not):
+        value = _fold(node.operand)
+        return None if value is None else not value
+    value = _constant(node)
+    return None if value is None else bool(value)
+
+
+def fold_constant(expression: str) -> Optional[bool]:
+    """
+    Evaluate a selection *expression* statically, e.g. ``1 == 0`` or ``1 == 0 && pt_1 > 20``. Returns None if
+    the value depends on columns or the expression cannot be evaluated statically.
+    """
+    tree = _parse(expression)
+    return None if tree is None else _fold(tree.body)
+
+
+# comparison operators, which are exchanged when the operands of a comparison are swapped
+MIRRORED_COMPARISONS = {ast.Lt: ast.Gt, ast.LtE: ast.GtE, ast.Gt: ast.Lt, ast.GtE: ast.LtE, ast.Eq: ast.Eq}
+
+
+def _bounds(node: ast.AST):
+    # comparisons of a single column with a constant, which must all hold for the condition to be true
+    if isinstance(node, ast.BoolOp) and isinstance(node.op, ast.And):
+        return [bound for value in node.values for bound in _bounds(value)]
+    if isinstance(node, ast.BoolOp):
+        # operands of a disjunction, which are always false, can be dropped
+        values = [value for value in node.values if _fold(value) is not False]
+        return _bounds(values[0]) if len(values) == 1 else []
+    if not isinstance(node, ast.Compare) or len(node.ops) != 1:
+        return []
+    left, right, op = node.left, node.comparators[0], type(node.ops[0])
+    if op not in MIRRORED_COMPARISONS:
+        return []
+    if isinstance(right, ast.Name):
+        left, right, op = right, left, MIRRORED_COMPARISONS[op]
+    value = _constant(right)
+    if not isinstance(left, ast.Name) or isinstance(value, bool) or not isinstance(value, (int, float)):
+        return []
+    return [(left.id, op, value)]
+
+
+def _contradicts(bounds) -> bool:
+    # intersect the intervals of the values, which each column may take, treating columns as real numbers
+    intervals = {}
+    for name, op, value in bounds:
+        lower, lower_strict, upper, upper_strict = intervals.get(name, (-math.inf, False, math.inf, False))
+        if op in (ast.Gt, ast.GtE, ast.Eq) and (value > lower or (value == lower and op is ast.Gt)):
+            lower, lower_strict = value, op is ast.Gt
+        if op in (ast.Lt, ast.LtE, ast.Eq) and (value < upper or (value == upper and op is ast.Lt)):
+            upper, upper_strict = value, op is ast.Lt
+        if lower > upper or (lower == upper and (lower_strict or upper_strict)):
+            return True
+        intervals[name] = (lower, lower_strict, upper, upper_strict)
+    return False
+
+
+def _filter(context, selection, name):
+    # cuts, which are always true, are dropped before they reach the event loop, as well as cuts, which are
+    # already applied by reading only the passing entries from a selection index
+    if fold_constant(selection) is True or selection in context.get("indexed_selections", ()):
+        return context
+    context["events"] = context["events"].Filter(selection, name)
+    return context
+
+
 def _norm_weight(context):
     # get the process, the dataset and the campaign
     process = context.get("process", None)
@@ -15,19 +138,29 @@ def _norm_weight(context):
     if process.is_data:
         return context
 
-    # get cross section, generator weight, luminosity and number of events
+    # get cross section, generator weight, luminosity and number of events; if files had to be skipped,
+    # only the processed fraction of the generated events enters the normalization
     lumi = campaign.x.lumi
-    n_gen_events = dataset.n_events
+    n_gen_events = dataset.n_events * context.get("processed_fraction", 1.0)
     xsec = process.xsecs[13]
     negative_events_fraction = process.x.generator_weight
 
-    # calculate the normalization weight
-    definition = sanitize_expression(
-        f"""
-        ( -1.0 * (genWeight < 0) + 1.0 * (genWeight > 0) ) / ({negative_events_fraction} * {n_gen_events})
-        * {xsec.nominal} * {lumi} * 1000
-        """
-    )
+    # calculate the normalization weight, use the sum of generator weights of the processed files if known
+    event_sums = context.get("event_sums", None)
+    if event_sums and event_sums.get("sum_gen_weights"):
+        definition = sanitize_expression(
+            f"""
+            genWeight / {event_sums["sum_gen_weights"]}
+            * {xsec.nominal} * {lumi} * 1000
+            """
+        )
+    else:
+        definition = sanitize_expression(
+            f"""
+            ( -1.0 * (genWeight < 0) + 1.0 * (genWeight > 0) ) / ({negative_events_fraction} * {n_gen_events})
+            * {xsec.nominal} * {lumi} * 1000
+            """
+        )
     context["events"] = context["events"].Define("norm_weight", definition)
 
     # add weight to the context
@@ -36,37 +169,97 @@ def _norm_weight(context):
     return context
 
 
+def _variation_placeholders(context):
+    # values, which can be used in the expressions of systematic variations
+    process = context.get("process", None)
+    placeholders = {}
+    if process is not None and not process.is_data:
+        # cross section variations require its uncertainty, which is optional in the sample database
+        xsec = process.xsecs[13]
+        if xsec.uncertainties:
+            placeholders["xsec_up_factor"] = xsec.get("up", factor=True)
+            placeholders["xsec_down_factor"] = xsec.get("down", factor=True)
+    return placeholders
+
+
+def systematic_variations(context, kind):
+    # group the up and down shifts of each systematic source of the requested kind
+    process = context.get("process", None)
+    sources = {}
+    for shift in context.get("shifts", []):
+        if shift.is_nominal or shift.x("kind", None) != kind:
+            continue
+        if shift.x("mc_only", False) and (process is None or process.is_data):
+            continue
+        sources.setdefault(shift.source, {})[shift.direction] = shift
+
+    if not sources:
+        return context
+
+    # book the variations of all sources, weight variations only apply to produced weights
+    placeholders = _variation_placeholders(context)
+    for source, shifts in sorted(sources.items()):
+        column = shifts["up"].x.column
+        if kind == "weight" and column not in context["weights"]:
+            continue
+        try:
+            expressions = [
+                sanitize_expression(shifts[direction].x.expression.format(**placeholders))
+                for direction in ("down", "up")
+            ]
+        except KeyError as e:
+            raise ValueError(
+                f"systematic shift '{source}' requires the value {e}, which is not available for process "
+                f"'{getattr(process, 'name', None)}', e.g. as its cross section has no uncertainty",
+            ) from e
+        context["events"] = context["events"].Vary(
+            column,
+            f"ROOT::RVec<{shifts['up'].x('type', 'double')}>{{{expressions[0]}, {expressions[1]}}}",
+            ["down", "up"],
+            source,
+        )
+
+    return context
+
+
 def weight_production(context):
     # add an empty weights list to the context
     context.setdefault("weights", [])
 
+    # variations of input columns have to be booked before anything depends on them
+    context = systematic_variations(context, "column")
+
     # produce the normalization weight for MC events
     context = _norm_weight(context)
 
-    # multiply weights in the weights list (or set weight to 1)
-    if len(context["weights"]) > 0:
+    # variations of single weights propagate to the total weight
+    context = systematic_variations(context, "weight")
+
+    # multiply weights in the weights list; a single weight is used directly and unweighted events (e.g.
+    # data) are filled without a weight column, so that no column has to be jitted for them
+    if len(context["weights"]) > 1:
         context["events"] = context["events"].Define(
             "total_weight",
             " * ".join(context["weights"]),
         )
+        context["weight_column"] = "total_weight"
+    elif len(context["weights"]) == 1:
+        context["weight_column"] = context["weights"][0]
     else:
-        context["events"] = context["events"].Define(
-            "total_weight",
-            "1",
-        )
+        context["weight_column"] = None
 
     return context
 
 
 def _trg_single_mu_selection(context):
-    selection = sanitize_expression(
-        """
-        (pt_1 >= 28. && trg_single_mu27 == 1)
-        || (pt_1 >= 25. && trg_single_mu24 == 1)
-        """
-    )
-    context["events"] = context["events"].Filter(selection, "trg_single_mu_selection")
-    return context
+    # the single muon triggers and their offline thresholds depend on the era; the expression is identical
+    # for all eras with the same triggers, so that its jitted code is shared by their event loops
+    triggers = context["campaign"].x.single_mu_triggers
+    selection = " || ".join([
+        f"(pt_1 >= {threshold:.1f} && {trigger} == 1)"
+        for trigger, threshold in triggers
+    ])
+    return _filter(context, selection, "trg_single_mu_selection")
 
 
 def _dibjet_selection(context):
@@ -94,8 +287,7 @@ def _dibjet_selection(context):
         )
         """
     )
-    context["events"] = context["events"].Filter(selection, "dibjet_selection")
-    return context
+    return _filter(context, selection, "dibjet_selection")
 
 
 def _dimuon_selection(context):
@@ -110,14 +302,12 @@ def _dimuon_selection(context):
         && q_1 * q_2 < 0
         """
     )
-    context["events"] = context["events"].Filter(selection, "dimuon_selection")
-    return context
+    return _filter(context, selection, "dimuon_selection")
 
 
 def _trg_ak8pfjet400_trimmass30_selection(context):
     selection = "trg_ak8pfjet400_trimmass30 == 1"
-    context["events"] = context["events"].Filter(selection, "dimuon_selection")
-    return context
+    return _filter(context, selection, "dimuon_selection")
     
 
 def _trg_pfht500_pfmet100_pfmht100_idtight_selection(context):
@@ -127,8 +317,7 @@ def _trg_pfht500_pfmet100_pfmht100_idtight_selection(context):
         && trg_ak8pfjet400_trimmass30 == 0
         """
     )
-    context["events"] = context["events"].Filter(selection, "trg_pfht500_pfmet100_pfmht100_idtight_selection")
-    return context
+    return _filter(context, selection, "trg_pfht500_pfmet100_pfmht100_idtight_selection")
 
 
 def channel_selection(context):
@@ -148,21 +337,176 @@ def channel_selection(context):
     # selection of the tt channel
     # tt channel is disabled for now
     if channel.name == "tt":
-        context["events"] = context["events"].Filter("1 == 0", "filter_all")
+        context = _filter(context, "1 == 0", "filter_all")
 
     return context
 
 
 def category_selection(context):
-    # get the channel
+    # get the category
     category = context.get("category")
 
+    # inclusive categories of a channel, which apply no selection in addition to the channel selection
+    if category.name in ("mm_incl", "tt_incl"):
+        pass
+
     # selection of the AK8 jet trigger category
-    if category.name == "sig_ak8jet_trigger":
-        context = _trg_ak8pfjet400_trimmass30_selection(context)       
+    elif category.name == "sig_ak8jet_trigger":
+        context = _trg_ak8pfjet400_trimmass30_selection(context)
 
     # selection of the HT trigger category
     elif category.name == "sig_pfht_trigger":
-        context = _trg_pfht500_pfmet100_pfmht100_idtight_selection(context)       
+        context = _trg_pfht500_pfmet100_pfmht100_idtight_selection(context)
+
+    # categories without a selection would silently fill the inclusive events
+    else:
+        raise ValueError(f"no selection defined for category {category.name}")
 
     return context
+
+
+class RecordedNode(object):
+    """
+    Stand-in for an RDataFrame node, which only records the Define and Filter calls applied to it. Used to
+    obtain the selection and weight expressions of a task without opening any file.
+    """
+
+    def __init__(self, operations=None):
+        self.operations = tuple(operations or ())
+
+    def Define(self, name, expression):
+        return RecordedNode(self.operations + (("Define", name, str(expression)),))
+
+    def Filter(self, expression, name=""):
+        return RecordedNode(self.operations + (("Filter", name, str(expression)),))
+
+    def Vary(self, column, expression, tags, name=""):
+        return RecordedNode(self.operations + (("Vary", name, column, str(expression), tuple(tags)),))
+
+
+def record_graph(context):
+    # run the weight production and the selections on a recording node instead of the real events
+    context = dict(context, events=RecordedNode())
+    context = weight_production(context)
+    context = channel_selection(context)
+    context = category_selection(context)
+    return context["events"].operations
+
+
+def selection_is_empty(operations) -> bool:
+    """
+    Return True if the recorded *operations* provably reject all events, i.e. if one of their cuts is
+    always false, e.g. for a disabled channel, or if the comparisons of a column with constants in all
+    cuts contradict each other, e.g. ``x > 1`` and ``x < 0``. Only comparisons, which are joined by ``&&``,
+    enter the latter check, while disjunctions, functions of columns (e.g. ``abs(eta_1)``) and integer
+    columns (e.g. ``n > 1 && n < 2``) are not analyzed; such selections are only found to be empty by the
+    event loop.
+    """
+    trees = [_parse(op[2]) for op in operations if op[0] == "Filter"]
+    trees = [tree for tree in trees if tree is not None]
+    if any(_fold(tree.body) is False for tree in trees):
+        return True
+    return _contradicts([bound for tree in trees for bound in _bounds(tree.body)])
+
+
+def book_histogram(events, variables, weight=None, binnings=None):
+    import numpy as np
+    import ROOT
+
+    # variable binnings as arrays, which can be passed to the histogram models
+    binnings = binnings or {}
+    edges = [np.array(binnings.get(v.name, v.bin_edges), dtype=np.float64) for v in variables]
+    binning = []
+    for _edges in edges:
+        binning.extend([len(_edges) - 1, _edges])
+    columns = [v.expression for v in variables] + ([weight] if weight else [])
+
+    # book the histogram action, which supports systematic variations in contrast to AsNumpy
+    if len(variables) == 1:
+        model = ROOT.RDF.TH1DModel("h", "", *binning)
+        return events.Histo1D(model, *columns)
+    elif len(variables) == 2:
+        model = ROOT.RDF.TH2DModel("h", "", *binning)
+        return events.Histo2D(model, *columns)
+    elif len(variables) == 3:
+        model = ROOT.RDF.TH3DModel("h", "", *binning)
+        return events.Histo3D(model, *columns)
+
+    raise ValueError(f"histograms with systematic variations support 1 to 3 variables, got {len(variables)}")
+
+
+def required_columns(operations, expressions=()):
+    """
+    Determine the input columns, which are read by the recorded *operations* and the additional
+    *expressions*. Columns defined by the operations themselves are not included.
+    """
+    defined = set()
+    required = set()
+    for op in operations:
+        if op[0] == "Define":
+            _, name, expression = op
+            required |= set(IDENTIFIER_PATTERN.findall(expression)) - defined
+            defined.add(name)
+        elif op[0] == "Filter":
+            required |= set(IDENTIFIER_PATTERN.findall(op[2])) - defined
+        elif op[0] == "Vary":
+            required |= ({op[2]} | set(IDENTIFIER_PATTERN.findall(op[3]))) - defined
+    for expression in expressions:
+        required |= set(IDENTIFIER_PATTERN.findall(expression)) - defined
+    return sorted(required - CXX_KEYWORDS - CXX_TYPES)
+
+
+def open_events(tree_name, files, columns, cache_size=100 * 1024 ** 2, entries=None, file_entries=None):
+    """
+    Create an RDataFrame on a chain, which only reads the branches in *columns*. Only these branches are
+    enabled and added to the TTree cache, and asynchronous prefetching of the following clusters is turned
+    on. If *entries* maps files to arrays of entry numbers, only these entries are read. Returns the
+    dataframe, the chain, which has to be kept alive as long as the dataframe is used, and an estimate of
+    the compressed bytes to be read, which is extrapolated from the first file to the numbers of entries in
+    *file_entries* if given, and to the number of files otherwise.
+    """
+    import ROOT
+
+    # prefetch the baskets of the next cluster while the current one is processed
+    ROOT.gEnv.SetValue("TFile.AsyncPrefetching", 1)
+
+    chain = ROOT.TChain(tree_name)
+    for f in files:
+        chain.Add(f)
+
+    # only enable the planned branches, which are present in the tree
+    chain.LoadTree(0)
+    tree = chain.GetTree()
+    available = {b.GetName() for b in tree.GetListOfBranches()}
+    branches = [c for c in columns if c in available]
+    chain.SetBranchStatus("*", 0)
+    for branch in branches:
+        chain.SetBranchStatus(branch, 1)
+
+    # TTree cache for the enabled branches only
+    chain.SetCacheSize(cache_size)
+    for branch in branches:
+        chain.AddBranchToCache(branch, True)
+    chain.StopCacheLearningPhase()
+
+    # estimate the bytes to read from the compressed sizes of the enabled branches in the first file, which
+    # is open already, so that no file has to be opened only for the estimate; with selected entries, the
+    # estimate scales with their number
+    zip_bytes = sum(tree.GetBranch(branch).GetZipBytes() for branch in branches)
+    if entries is not None:
+        file_entries = {f: len(entries.get(f, ())) for f in files}
+    if file_entries and tree.GetEntries() > 0:
+        planned_bytes = zip_bytes / tree.GetEntries() * sum(file_entries.get(f, 0) for f in files)
+    else:
+        planned_bytes = zip_bytes * len(files)
+
+    # restrict the chain to the selected entries, the entry list is owned by the chain; baskets without
+    # selected entries are skipped, while baskets with only few of them are still read entirely
+    if entries is not None:
+        from trigger_sf.util.selection_index import entry_list
+
+        selected = entry_list(tree_name, entries)
+        ROOT.SetOwnership(selected, False)
+        chain.SetEntryList(selected)
+
+    return ROOT.RDataFrame(chain), chain, planned_bytes
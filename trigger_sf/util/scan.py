@@ -0,0 +1,69 @@
+"""
+A scan file defines a grid of trigger efficiency measurements, e.g.
+
+    channel: mm
+    processes: [data, dyjets, ttbar]
+    variables:
+      - [met, ht]
+      - [mht_pt, ht]
+    binnings:
+      met:
+        coarse: [0, 100, 200, 400]
+        fine: [0, 50, 100, 150, 200, 250, 300, 350, 400]
+    categories:
+      - [mm_incl, sig_pfht_trigger]
+
+Each point of the scan is a combination of one set of variables, one binning for each of these variables
+and one pair of reference and signal+reference categories. Variables without entry in 'binnings' use the
+binning from the config.
+"""
+
+from __future__ import annotations
+from functools import cache
+import hashlib
+import itertools
+from pathlib import Path
+from typing import Any, Dict, List
+import yaml
+
+
+@cache
+def load_scan(scan_file: Path | str) -> Dict[str, Any]:
+    with open(scan_file, mode="r") as f:
+        scan = yaml.safe_load(f)
+    return scan
+
+
+def scan_file_hash(scan_file: Path | str) -> str:
+    with open(scan_file, mode="rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def scan_points(scan: Dict[str, Any]) -> List[Dict[str, Any]]:
+    binnings = scan.get("binnings", {})
+
+    points = []
+    for variables, (ref_category, sig_ref_category) in itertools.product(scan["variables"], scan["categories"]):
+        # all combinations of binnings for the variables of this point
+        binning_choices = [
+            list(binnings.get(variable, {"default": None}).items())
+            for variable in variables
+        ]
+        for choice in itertools.product(*binning_choices):
+            binning_names = [name for name, _ in choice]
+            points.append({
+                "name": "__".join(
+                    [ref_category, sig_ref_category]
+                    + [f"{variable}-{name}" for variable, name in zip(variables, binning_names)]
+                ),
+                "variables": tuple(variables),
+                "binnings": {
+                    variable: list(edges)
+                    for variable, (_, edges) in zip(variables, choice)
+                    if edges is not None
+                },
+                "ref_category": ref_category,
+                "sig_ref_category": sig_ref_category,
+            })
+
+    return points
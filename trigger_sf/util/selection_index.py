@@ -0,0 +1,98 @@
+"""
+Per-file index of the pass/fail flags of all selection cuts, stored as bit-packed arrays. Cuts are
+identified by a hash of their expression, so that changed selections are not taken from an outdated
+index. The entries passing any combination of indexed cuts are obtained with vectorised bit operations
+and read through a TEntryList instead of evaluating the cuts event by event.
+"""
+
+from __future__ import annotations
+from typing import Dict, Iterable, List, Sequence, Tuple
+
+import numpy as np
+
+from trigger_sf.util.manifest import fingerprint
+from trigger_sf.util.rdf import IDENTIFIER_PATTERN, fold_constant
+
+
+def cut_key(expression: str) -> str:
+    return fingerprint(expression)[:12]
+
+
+def indexable_cuts(operations_list: Iterable[Sequence[tuple]]) -> Tuple[List[tuple], Dict[str, str]]:
+    """
+    Collect the cuts of several recorded selection graphs, e.g. of all categories of a channel, together
+    with the Define operations they depend on. Constant cuts are not indexed, as they are folded anyway.
+    Returns the Define operations in the order of their first appearance and a mapping of cut keys to
+    expressions.
+    """
+    defines, cuts = {}, {}
+    for operations in operations_list:
+        for op in operations:
+            if op[0] == "Define":
+                defines.setdefault(op[1], op)
+            elif op[0] == "Filter" and fold_constant(op[2]) is None:
+                cuts[cut_key(op[2])] = op[2]
+
+    # only the columns the cuts depend on have to be defined, directly or via other defined columns
+    needed = set()
+    pending = set().union(*[IDENTIFIER_PATTERN.findall(expression) for expression in cuts.values()])
+    while pending:
+        name = pending.pop()
+        if name in defines and name not in needed:
+            needed.add(name)
+            pending |= set(IDENTIFIER_PATTERN.findall(defines[name][2]))
+
+    return [op for name, op in defines.items() if name in needed], cuts
+
+
+def compute_masks(uri: str, tree_name: str, defines: Sequence[tuple], cuts: Dict[str, str]) -> Dict:
+    # evaluate all cuts of one file in a single event loop and pack the flags into bits
+    import ROOT
+    from trigger_sf.util.files import tree_entries
+
+    # without cuts, only the number of entries is needed, which is read from the tree header
+    if not cuts:
+        return {"n_entries": tree_entries(uri, tree_name), "masks": {}}
+
+    events = ROOT.RDataFrame(tree_name, uri)
+    for _, name, expression in defines:
+        events = events.Define(name, expression)
+    columns = []
+    for key, expression in cuts.items():
+        events = events.Define(f"tsf_cut_{key}", f"static_cast<bool>({expression})")
+        columns.append(f"tsf_cut_{key}")
+    values = events.AsNumpy(columns=columns)
+
+    return {
+        "n_entries": len(values[columns[0]]),
+        "masks": {key: np.packbits(values[f"tsf_cut_{key}"].astype(bool)) for key in cuts},
+    }
+
+
+def selected_entries(masks: Dict[str, np.ndarray], n_entries: int, keys: Sequence[str]) -> np.ndarray:
+    # entries passing all cuts, combined on the packed bits before unpacking
+    selected = np.full((n_entries + 7) // 8, 0xFF, dtype=np.uint8)
+    for key in keys:
+        selected &= masks[key]
+    return np.flatnonzero(np.unpackbits(selected, count=n_entries)).astype(np.int64)
+
+
+def entry_list(tree_name: str, entries: Dict[str, np.ndarray]):
+    # entry list of a chain with one sub-list per file, filled in C++ from the arrays of entry numbers
+    import ROOT
+
+    if not hasattr(ROOT, "tsf_fill_entry_list"):
+        ROOT.gInterpreter.Declare("""
+            void tsf_fill_entry_list(TEntryList &list, const Long64_t *entries, std::size_t n) {
+                for (std::size_t i = 0; i < n; ++i) list.Enter(entries[i]);
+            }
+        """)
+
+    chain_list = ROOT.TEntryList("tsf_entries", "")
+    for uri, file_entries in entries.items():
+        file_list = ROOT.TEntryList("", "", tree_name, uri)
+        file_entries = np.ascontiguousarray(file_entries, dtype=np.int64)
+        ROOT.tsf_fill_entry_list(file_list, file_entries, len(file_entries))
+        chain_list.Add(file_list)
+
+    return chain_list
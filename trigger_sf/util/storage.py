@@ -0,0 +1,12 @@
+# storage profiles of the histograms filled by CreateHistograms, trading memory for accuracy:
+#   weight:  sums of weights and of squared weights as float64, 16 bytes per bin; exact for all weights
+#   compact: counters for data, which start at 1 byte per bin and widen only when a bin overflows, with
+#            variances equal to the counts; MC uses the weight storage; exact as data has unit weights
+#   double:  sums of weights as float64, 8 bytes per bin; variances are only known for unit weights, so
+#            the weighted MC statistical uncertainty is lost (the efficiency intervals use the sums only)
+#   sparse:  weight storage, but the category and process axes only hold the slices, which are actually
+#            filled, instead of all categories and processes of the config; exact, and smaller by the
+#            number of category and process combinations for the histograms of a single job
+# boost-histogram provides no float32 storages, so the profiles only choose among the existing ones; the
+# profiles are defined in this module without any imports, so that task parameters can use them
+STORAGE_PROFILES = ("weight", "compact", "double", "sparse")